@@ -1,13 +1,14 @@
 import asyncio
 import logging
-from typing import AsyncGenerator
-from fastapi import APIRouter, Depends, HTTPException
+from typing import AsyncGenerator, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 from campus_rag.domain.rag.po import Query
 from campus_rag.domain.rag.vo import TaskResponse
 from campus_rag.impl.rag.pipeline_entry import (
   start_pipeline,
   get_rag_stream,
+  get_task_counts,
   task_exists,
 )
 from campus_rag.impl.user.user import get_current_user
@@ -24,6 +25,12 @@ async def start_rag_pipeline_task(
   return JSONResponse(content={"task_id": await start_pipeline(query, user)})
 
 
+@router.get("/tasks/metrics")
+async def get_rag_task_metrics() -> dict:
+  """Live and finished pipeline tasks of this worker."""
+  return await get_task_counts()
+
+
 @router.get(
   "/stream/{task_id}",
   response_class=StreamingResponse,
@@ -35,22 +42,39 @@ async def start_rag_pipeline_task(
     404: {"description": "Task not found"},
   },
 )
-async def stream_rag_pipeline_results(task_id: str) -> StreamingResponse:
-  if not task_exists(task_id):
+async def stream_rag_pipeline_results(
+  task_id: str, request: Request, last_event_id: Optional[str] = Header(None)
+) -> StreamingResponse:
+  if not await task_exists(task_id):
     raise HTTPException(status_code=404, detail=f"Task with ID {task_id} not found.")
+  # Every chunk is sent with its index as the event id, a reconnecting
+  # EventSource sends the last one back and resumes after it
+  offset = 0
+  if last_event_id is not None:
+    try:
+      offset = int(last_event_id) + 1
+    except ValueError:
+      raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
 
   async def event_stream() -> AsyncGenerator[str, None]:
+    stream = get_rag_stream(task_id, offset)
     try:
-      async for chunk in get_rag_stream(task_id):
+      event_id = offset
+      async for chunk in stream:
         if chunk is None:
           break
-        yield f"data: {chunk}\n\n"
+        # Sending to a gone client does not fail, so check before every chunk
+        if await request.is_disconnected():
+          logger.info(f"Client of task {task_id} disconnected")
+          return
+        yield f"id: {event_id}\ndata: {chunk}\n\n"
+        event_id += 1
       yield "data: [DONE]\n\n"  # Signal end of stream
     except asyncio.CancelledError:
       raise
     finally:
-      # Optional: More robust cleanup?
-      # Be careful removing the task entry here if multiple clients could stream
-      pass
+      # Unsubscribe right away, the task is cancelled once it has no client
+      # left for a while. Other clients may still stream it.
+      await stream.aclose()
 
   return StreamingResponse(event_stream(), media_type="text/event-stream")
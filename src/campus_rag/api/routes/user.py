@@ -1,3 +1,4 @@
+from typing import Optional
 from fastapi import Depends
 from fastapi.routing import APIRouter
 from fastapi.security import OAuth2PasswordRequestForm
@@ -38,8 +39,12 @@ async def get_conversations(
   first_id: int = 0,
   limit: int = 10,
   sorted_by: SortedBy = SortedBy.updated,
+  cursor: Optional[str] = None,
 ) -> list[ConversationView]:
-  return await conv_impl.get_conversations(user, first_id, limit, sorted_by)
+  """Pass the cursor of the last conversation of a page to get the next page."""
+  return await conv_impl.get_conversations(
+    user, first_id, limit, sorted_by, cursor=cursor
+  )
 
 
 @router.get(
@@ -47,6 +52,12 @@ async def get_conversations(
   response_model=list[ChatMessage],
 )
 async def get_chat_history(
-  conversation_id: str, user: User = Depends(user_impl.get_current_user)
+  conversation_id: str,
+  user: User = Depends(user_impl.get_current_user),
+  after_id: Optional[str] = None,
+  limit: Optional[int] = None,
 ) -> list[ChatMessage]:
-  return await conv_impl.get_chat_history(user, conversation_id)
+  """Pass the id of the last message of a page as after_id to get the next."""
+  return await conv_impl.get_chat_history(
+    user, conversation_id, after_id=after_id, limit=limit
+  )
@@ -3,3 +3,28 @@ CONTEXT_PREFIX = "WLG_CONTEXT: "
 CONTEXT_SUFFIX = "WLG_CONTEXT DONE"
 ANSWER_PREFIX = "WLG_ANSWER: "
 TEST_PREFIX = "WLG_TEST: "
+
+# Max number of pipeline tasks kept by a worker, running and finished
+TASK_MAX_SIZE = 1024
+# Seconds a finished task is kept for late stream clients
+TASK_TTL = 600
+# Where pipeline tasks live: "memory" for a single worker, "redis" to share
+# them between workers
+TASK_BACKEND = "memory"
+TASK_KEY_PREFIX = "rag_task:"
+# Redis backend: max chunks per read, and ms a read waits for new chunks
+TASK_STREAM_READ_COUNT = 256
+TASK_STREAM_BLOCK_MS = 5000
+# Max chunks a task runs ahead of its slowest stream client
+TASK_MAX_LAG = 256
+# Seconds a task runs on without any stream client before it is cancelled,
+# also the longest it waits for a slow client
+TASK_ABANDON_GRACE = 30
+TASK_SUBSCRIBER_CHECK_INTERVAL = 5
+# Redis backend: seconds a stream client's heartbeat stays valid
+TASK_HEARTBEAT_TTL = 15
+# Max conversations waiting for their LLM generated title
+TITLE_QUEUE_SIZE = 1024
+# Max messages loaded as chat history, the prompt keeps the most recent ones
+# that fit in its length budget
+HISTORY_WINDOW_SIZE = 32
@@ -0,0 +1,9 @@
+# Max number of completions a worker runs against the LLM backend at once
+LLM_MAX_CONCURRENCY = 16
+# Max number of completions started per second, None for no limit
+LLM_RATE_PER_SECOND = 8
+# Seconds before a completion (or a chunk of a stream) times out
+LLM_TIMEOUT = 60.0
+LLM_CONNECT_TIMEOUT = 5.0
+LLM_MAX_CONNECTIONS = 32
+LLM_MAX_RETRIES = 3
@@ -3,5 +3,7 @@ COLLECTION_NAME = "chat"
 START_FIELD = "meta"
 COLLECTIONS = [COLLECTION_NAME]
 TEACHER_MAX = 4096
+# Upper bound of topk for a single milvus search
+SEARCH_LIMIT_MAX = 16384
 
 INSERT_BATCH_SIZE = 64
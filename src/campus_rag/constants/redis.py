@@ -1,2 +1,12 @@
 REDIS_PORT = 6379
-REDIS_PASSWD = "123456"
\ No newline at end of file
+REDIS_PASSWD = "123456"
+REDIS_MAX_CONNECTIONS = 64
+# Seconds to wait for a free pooled connection before giving up
+REDIS_POOL_TIMEOUT = 1
+# Blocking stream reads hold their connection for seconds, so they get their
+# own pool and never starve the other commands
+REDIS_STREAM_MAX_CONNECTIONS = 256
+REDIS_STREAM_POOL_TIMEOUT = 10
+# Bumped on every knowledge base change, workers drop their semantic caches
+# once they see a new value
+SEMANTIC_CACHE_VERSION_KEY = "semantic_cache:version"
@@ -1,3 +1,26 @@
 SQLITE_FILE_NAME = "./data/campuse_rag.db"
 SQLITE_SYNC_URL = f"sqlite:///{SQLITE_FILE_NAME}"
 SQLITE_ASYNC_URL = f"sqlite+aiosqlite:///{SQLITE_FILE_NAME}"
+
+# Engine profiles: connection pool size and pragmas run on every connection
+SQLITE_PROFILES = {
+  # SQLAlchemy and SQLite defaults, rollback journal: a writer blocks readers
+  "default": {"pool_size": 5, "max_overflow": 10, "pragmas": {}},
+  # Write-ahead log: readers go on while one connection writes, and a commit
+  # only fsyncs at checkpoints
+  "wal": {
+    "pool_size": 16,
+    "max_overflow": 16,
+    "pragmas": {
+      "journal_mode": "WAL",
+      "synchronous": "NORMAL",
+      # Wait for the write lock (ms) instead of failing with "database is locked"
+      "busy_timeout": 5000,
+      "mmap_size": 256 * 1024 * 1024,
+      # Negative means KiB, per connection
+      "cache_size": -16 * 1024,
+      "temp_store": "MEMORY",
+    },
+  },
+}
+SQLITE_PROFILE = "wal"
@@ -1,7 +1,9 @@
 from pydantic import BaseModel
-from typing import Optional, TYPE_CHECKING
+from typing import Any, Optional, TYPE_CHECKING
 from enum import Enum
+from campus_rag.constants.conversation import ANSWER_PREFIX, STATUS_PREFIX, TEST_PREFIX
 from sqlmodel import Field, SQLModel, Relationship
+from sqlalchemy import Index
 import uuid
 import time
 
@@ -18,6 +20,12 @@ def uuid_str():
 
 
 class Conversation(SQLModel, table=True):
+  # Keyset pagination of a user's conversations, see find_conversations_by_user
+  __table_args__ = (
+    Index("ix_conversation_user_update", "user_id", "update_time", "conversation_id"),
+    Index("ix_conversation_user_create", "user_id", "create_time", "conversation_id"),
+  )
+
   conversation_id: str = Field(
     default_factory=uuid_str, primary_key=True, nullable=False
   )  # Generated by uuid
@@ -34,6 +42,16 @@ class Conversation(SQLModel, table=True):
 
 
 class ChatMessage(SQLModel, table=True):
+  # Ordered history of a conversation, see find_messages_by_conversation
+  __table_args__ = (
+    Index(
+      "ix_chatmessage_conversation_create",
+      "conversation_id",
+      "create_time",
+      "message_id",
+    ),
+  )
+
   message_id: str = Field(default_factory=uuid_str, primary_key=True, nullable=False)
   conversation_id: str = Field(
     foreign_key="conversation.conversation_id", index=True, nullable=False
@@ -83,3 +101,46 @@ class SearchConfig:
     self.filter_expr = filter_expr
     self.output_fields = output_fields
     self.offset = offset
+
+
+class QueryEmbedding:
+  """Dense and sparse embeddings of a query.
+  Computed once per chat turn and shared by every search of that turn.
+  """
+
+  def __init__(self, dense, sparse):
+    self.dense = dense
+    self.sparse = sparse
+
+
+class ChatEventKind(str, Enum):
+  STATUS = "status"
+  CONTEXT = "context"  # Retrieved context text
+  ANSWER_START = "answer_start"
+  ANSWER = "answer"  # One token of the answer
+  TEST = "test"  # Retrieved chunks, only in test mode
+
+
+class ChatEvent:
+  """One event streamed by the chat pipeline.
+  `render()` gives the text sent to the client, the kind lets consumers pick
+  the answer tokens without parsing the stream.
+  """
+
+  def __init__(self, kind: ChatEventKind, content: Any = ""):
+    self.kind = kind
+    self.content = content
+
+  def render(self) -> str:
+    if self.kind == ChatEventKind.STATUS:
+      return f"{STATUS_PREFIX} {self.content}"
+    if self.kind == ChatEventKind.CONTEXT:
+      return f"{STATUS_PREFIX} Collecting context... {self.content}"
+    if self.kind == ChatEventKind.ANSWER_START:
+      return f"{ANSWER_PREFIX}\\n"
+    if self.kind == ChatEventKind.TEST:
+      return f"{TEST_PREFIX} Test mode, returning chunk IDs: \\n"
+    return self.content
+
+  def __str__(self) -> str:
+    return self.render()
@@ -6,13 +6,18 @@ from typing import Optional
 class ConversationView(BaseModel):
   conversation_id: str
   title: Optional[str] = None
+  # Opaque, pass it back to list the conversations after this one
+  cursor: Optional[str] = None
 
   @classmethod
-  def fromVO(cls, conversation: Conversation) -> "ConversationView":
+  def fromVO(
+    cls, conversation: Conversation, cursor: Optional[str] = None
+  ) -> "ConversationView":
     """Converts a Conversation object to a ConversationView."""
     return ConversationView(
       conversation_id=conversation.conversation_id,
       title=conversation.title,
+      cursor=cursor,
     )
 
 
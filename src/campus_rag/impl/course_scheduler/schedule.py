@@ -90,7 +90,9 @@ async def generate_plan(
   Returns:
       PlanView: A generated course plan containing a description and selected courses.
   """
-  keyword_explain_str = get_keyword_explain("./data/keywords_for_schedule.json")
+  keyword_explain_str = get_keyword_explain(
+    "./data/keywords_for_schedule.json", constraint
+  )
   course_splitter = "\n\n"
   prompt = [
     {
@@ -7,7 +7,7 @@ from campus_rag.constants.milvus import (
   MILVUS_URI,
   COLLECTION_NAME,
 )
-from campus_rag.infra.reranker import reranker
+from campus_rag.infra.reranker import get_reranker
 from campus_rag.infra.milvus.hybrid_retrieve import HybridRetriever
 from campus_rag.domain.rag.po import SearchConfig
 from fastapi.concurrency import run_in_threadpool
@@ -55,7 +55,7 @@ async def get_topk_results_by_query(
   config = SearchConfig(limit=topk * 2, offset=0, filter_expr=expr)
   result = await hr.retrieve(query, config)
   result = await run_in_threadpool(
-    reranker.rerank,
+    get_reranker().rerank,
     query=query,
     results=result,
   )
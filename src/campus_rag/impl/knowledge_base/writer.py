@@ -3,6 +3,8 @@ import uuid
 from pymilvus import MilvusClient, DataType
 from campus_rag.constants.milvus import MILVUS_URI, COLLECTION_NAME
 from campus_rag.infra.embedding import sparse_embedding_model, embedding_model
+from campus_rag.infra.reranker import get_reranker
+from campus_rag.infra.semantic_cache import invalidate_semantic_caches
 from campus_rag.utils.chunk_ops import construct_embedding_key
 from campus_rag.utils.logging_config import setup_logger
 import json
@@ -91,6 +93,7 @@ async def upload(
     )
     # immediately flush for search
     mc.flush(collection_name=COLLECTION_NAME)
+    await invalidate_semantic_caches()
     return True
   except Exception as e:
     logger.error(e)
@@ -114,6 +117,8 @@ async def delete_knowledge_by_id(request_id: str) -> bool:
       ids=[request_id],
     )
     mc.flush(collection_name=COLLECTION_NAME)
+    get_reranker().invalidate(request_id)
+    await invalidate_semantic_caches()
     return True
   except Exception as e:
     logger.error(e)
@@ -158,6 +163,8 @@ async def modify(
       collection_name=COLLECTION_NAME,
       data=new_data,
     )
+    get_reranker().invalidate(request_id)
+    await invalidate_semantic_caches()
     return True
   except Exception as e:
     logger.error(e)
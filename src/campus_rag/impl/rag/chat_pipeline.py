@@ -1,5 +1,5 @@
 from fastapi.concurrency import run_in_threadpool
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 import asyncio
 import logging
 
@@ -7,40 +7,121 @@ from campus_rag.constants.prompt import SYSTEM_PROMPT
 from campus_rag.impl.rag.llm_tool.enhance_query import enhance_query
 from campus_rag.impl.rag.llm_tool.reflect import reflect_query, ReflectionCategory
 from campus_rag.impl.rag.llm_tool.route import route_query
+from campus_rag.impl.rag.llm_tool.enhance_route import enhance_and_route
 from campus_rag.infra.milvus.hybrid_retrieve import HybridRetriever
-from campus_rag.infra.reranker import reranker
+from campus_rag.infra.reranker import get_reranker
+from campus_rag.infra.semantic_cache import (
+  answer_cache,
+  embed_query,
+  enhance_route_cache,
+  sync_semantic_caches,
+)
 from campus_rag.impl.rag.generate import generate_answer
 from campus_rag.constants.milvus import COLLECTION_NAME
 from campus_rag.constants.conversation import (
   CONTEXT_SUFFIX,
-  STATUS_PREFIX,
   CONTEXT_PREFIX,
-  ANSWER_PREFIX,
   TEST_PREFIX,
 )
-from campus_rag.domain.rag.po import ChatMessage, SearchConfig
+from campus_rag.domain.rag.po import (
+  ChatEvent,
+  ChatEventKind,
+  ChatMessage,
+  QueryEmbedding,
+  SearchConfig,
+)
 from campus_rag.infra.milvus.init import campus_rag_mc
 
 _KEYWORDS_PATH = "./data/keywords.json"
 logger = logging.getLogger(__name__)
 
 
+async def _yield_wrapper(log_info: str, event: ChatEvent):
+  """
+  A wrapper function to yield an event while logging the process.
+
+  Args:
+      log_info (str): Information to log.
+      event (ChatEvent): Event to yield.
+
+  Yields:
+      ChatEvent: The event to yield.
+  """
+  logger.debug(log_info)
+  yield event
+  await asyncio.sleep(0)
+
+
+def _discard_task(task: Optional[asyncio.Task]):
+  """Drops a side task whose result is no longer needed: cancels it if it is
+  still running, otherwise marks its exception as retrieved."""
+  if task is None:
+    return
+  if not task.done():
+    task.cancel()
+  elif not task.cancelled():
+    task.exception()
+
+
 class ChatPipeline:
   """对话的流水线
   这个类接收用户查询、历史记录，走一遍管道，并输出流式信息
   但是不会负责对话类的管理，也就是说是stateless的
   """
 
-  def __init__(self, test: bool = False):
+  def __init__(
+    self,
+    test: bool = False,
+    retrieval_mode: str = "per_source",
+    rerank_mode: str = "per_source",
+    route_mode: str = "sequential",
+    use_semantic_cache: bool = False,
+    cache_answers: bool = False,
+    reflect: bool = False,
+  ):
+    """
+    Args:
+      test: Return the retrieved chunks instead of only generating.
+      retrieval_mode: "per_source" runs one filtered milvus search per routed
+        source, "multi_source" runs a single search over all routed sources
+        and splits the hits by source locally.
+      rerank_mode: "per_source" reranks the candidates of every source on its
+        own, "global" dedups the candidates of all sources and scores them in
+        a single cross-encoder pass before the quotas are applied.
+      route_mode: "sequential" routes the enhanced query after enhancement,
+        "parallel" routes the raw query concurrently with enhancement, "fused"
+        gets the enhanced query and the sources from a single LLM call.
+      use_semantic_cache: Reuse the enhanced query, sources and query
+        embeddings of a semantically identical earlier query. Off by default,
+        the similarity threshold has not been evaluated on e5 yet, and close
+        but different questions (e.g. about two course numbers) can score
+        above it.
+      cache_answers: Also reuse the context and answer of a semantically
+        identical earlier query, only for turns without history.
+      reflect: Classify the query concurrently with enhancement and retrieval,
+        irrelevant queries skip retrieval and are answered without context.
+    """
     self.enhance_query = enhance_query
     self.mc = campus_rag_mc
     self.hybrid_retriever = HybridRetriever(mc=self.mc, collection_name=COLLECTION_NAME)
     self.collection_name = COLLECTION_NAME
-    self.reranker = reranker
+    self.reranker = get_reranker()
     self.async_generator = generate_answer
     self.limit = 50
     self.top_k = 5
     self.test = test
+    if retrieval_mode not in ("per_source", "multi_source"):
+      raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+    self.retrieval_mode = retrieval_mode
+    if rerank_mode not in ("per_source", "global"):
+      raise ValueError(f"Unknown rerank mode: {rerank_mode}")
+    self.rerank_mode = rerank_mode
+    if route_mode not in ("sequential", "parallel", "fused"):
+      raise ValueError(f"Unknown route mode: {route_mode}")
+    self.route_mode = route_mode
+    self.use_semantic_cache = use_semantic_cache
+    self.cache_answers = cache_answers
+    self.reflect = reflect
     self.available_sources = ["course", "teacher", "manual"]
     self.search_strategy = {
       "course": 5,
@@ -70,101 +151,310 @@ class ChatPipeline:
     # TODO: Implement minimal_start generate
     pass
 
-  async def start(self, query: str, history: list[ChatMessage]) -> AsyncGenerator:
-    async def _yield_wrapper(log_info: str, yield_info: str):
-      """
-      A wrapper function to yield information while logging the process.
+  async def _retrieve_source(
+    self, source: str, query: str, query_embedding: QueryEmbedding
+  ) -> tuple[str, list[dict]]:
+    """Hybrid search one source and rerank its candidates.
+    Args:
+      source: Source name, "global" means no source filter.
+      query: The (enhanced) query.
+      query_embedding: Embeddings of `query`, shared by all sources.
+    Returns:
+      The source name and its reranked results, so that callers waiting on
+      several sources at once know which one finished.
+    """
+    if source != "global":
+      filter_expr = f'source == "{source}"'
+    else:
+      filter_expr = None
+    source_results = await self.hybrid_retriever.retrieve(
+      question=query,
+      config=SearchConfig(
+        limit=self.limit,
+        output_fields=["*"],
+        filter_expr=filter_expr,
+      ),
+      query_embedding=query_embedding,
+    )
+    return await self._rerank_source(source, query, source_results)
 
-      Args:
-          log_info (str): Information to log.
-          yield_info (str): Information to yield.
+  async def _rerank_source(
+    self, source: str, query: str, source_results: list[dict]
+  ) -> tuple[str, list[dict]]:
+    """Rerank the candidates of one source, see `_retrieve_source`.
+    In global rerank mode the candidates are returned as is, they are scored
+    together with the other sources by `_rerank_pool`.
+    """
+    if self.rerank_mode == "global":
+      return source, source_results
+    source_reranked = await run_in_threadpool(
+      self.reranker.rerank,
+      query=query,
+      results=source_results,
+    )
+    return source, source_reranked
 
-      Yields:
-          str: The information to yield.
-      """
-      logger.debug(log_info)
-      yield yield_info
-      await asyncio.sleep(0)
+  async def _rerank_pool(
+    self, query: str, source_results_map: dict[str, list[dict]]
+  ) -> dict[str, list[dict]]:
+    """Score the unique candidates of all sources in one rerank call.
+    Returns:
+      Map from source to its candidates, sorted by the pooled scores.
+    """
+    pool = {}
+    for source_results in source_results_map.values():
+      for result in source_results:
+        pool.setdefault(result["id"], result)
+    reranked = await run_in_threadpool(
+      self.reranker.rerank,
+      query=query,
+      results=list(pool.values()),
+    )
+    reranked_map = {}
+    for source, source_results in source_results_map.items():
+      source_ids = {result["id"] for result in source_results}
+      reranked_map[source] = [res for res in reranked if res["id"] in source_ids]
+    return reranked_map
 
+  async def _start_retrieval(
+    self, sources: list[str], query: str, query_embedding: QueryEmbedding
+  ) -> list[asyncio.Task]:
+    """Start retrieving every source, according to `self.retrieval_mode`.
+    Returns:
+      One task per source, each resolves to (source, reranked results).
+    """
+    if not sources:
+      return []
+    if self.retrieval_mode == "per_source":
+      return [
+        asyncio.create_task(self._retrieve_source(source, query, query_embedding))
+        for source in sources
+      ]
+    source_results_map = await self.hybrid_retriever.retrieve_by_sources(
+      question=query,
+      sources=sources,
+      config=SearchConfig(limit=self.limit, output_fields=["*"]),
+      query_embedding=query_embedding,
+    )
+    return [
+      asyncio.create_task(
+        self._rerank_source(source, query, source_results_map[source])
+      )
+      for source in sources
+    ]
+
+  @staticmethod
+  def _is_irrelevant(reflect_task: asyncio.Task) -> bool:
+    """Whether a finished reflection classified the query as irrelevant."""
+    try:
+      category = ReflectionCategory(int(reflect_task.result()["category"]))
+    except Exception as e:
+      logger.error(f"Reflection failed, keep retrieving: {e}")
+      return False
+    return category == ReflectionCategory.IRRELEVANT
+
+  async def start(self, query: str, history: list[ChatMessage]) -> AsyncGenerator:
     # ENHANCE STATUS
-    async for chunk in _yield_wrapper(
-      "Enhancing query...", f"{STATUS_PREFIX} Enhancing query...{query}\\n"
-    ):
-      yield chunk
-    enhanced_query = await self.enhance_query(query, _KEYWORDS_PATH)
-    async for chunk in _yield_wrapper(
-      f"Enhanced query: {enhanced_query}",
-      f"{STATUS_PREFIX} Enhanced query done, retrieving chunks...{enhanced_query}\\n",
+    async for event in _yield_wrapper(
+      "Enhancing query...",
+      ChatEvent(ChatEventKind.STATUS, f"Enhancing query...{query}\\n"),
     ):
-      yield chunk
+      yield event
+    reflect_task = None
+    if self.reflect:
+      # Only needs the raw query, so it overlaps with every later stage
+      reflect_task = asyncio.create_task(reflect_query(query, [], SYSTEM_PROMPT))
+    run = self._run(query, history, reflect_task)
+    try:
+      async for event in run:
+        yield event
+    finally:
+      await run.aclose()
+      _discard_task(reflect_task)
 
-    # ROUTE STATUS
-    routed_sources = await route_query(enhanced_query)
+  async def _run(
+    self,
+    query: str,
+    history: list[ChatMessage],
+    reflect_task: Optional[asyncio.Task],
+  ) -> AsyncGenerator:
+    cache_embedding = None
+    cached = None
+    if self.use_semantic_cache and await sync_semantic_caches():
+      cache_embedding = await embed_query(query)
+      if self.cache_answers and not history:
+        cached_answer = answer_cache.lookup(cache_embedding)
+        if cached_answer is not None:
+          results_text, answer_tokens = cached_answer
+          async for event in _yield_wrapper(
+            "Answer semantic cache hit",
+            ChatEvent(ChatEventKind.CONTEXT, results_text),
+          ):
+            yield event
+          yield ChatEvent(ChatEventKind.ANSWER_START)
+          for token in answer_tokens:
+            yield ChatEvent(ChatEventKind.ANSWER, token)
+            await asyncio.sleep(0)
+          return
+      cached = enhance_route_cache.lookup(cache_embedding)
+
+    route_task = None
+    encode_task = None
+    try:
+      if cached is not None:
+        enhanced_query, routed_sources, query_embedding = cached
+        routed_sources = list(routed_sources)
+      elif self.route_mode == "fused":
+        enhanced_query, routed_sources = await enhance_and_route(query, _KEYWORDS_PATH)
+      else:
+        if self.route_mode == "parallel":
+          # Route on the raw query while it is being enhanced
+          route_task = asyncio.create_task(route_query(query))
+        enhanced_query = await self.enhance_query(query, _KEYWORDS_PATH)
+      async for event in _yield_wrapper(
+        f"Enhanced query: {enhanced_query}",
+        ChatEvent(
+          ChatEventKind.STATUS,
+          f"Enhanced query done, retrieving chunks...{enhanced_query}\\n",
+        ),
+      ):
+        yield event
+
+      if cached is None:
+        # Encode the enhanced query while routing, every source search reuses it
+        encode_task = asyncio.create_task(self.hybrid_retriever.encode(enhanced_query))
+
+      # ROUTE STATUS
+      if cached is None and self.route_mode == "sequential":
+        routed_sources = await route_query(enhanced_query)
+      elif route_task is not None:
+        routed_sources = await route_task
+    finally:
+      # Enhancing failed or the run was closed before the route was awaited
+      _discard_task(route_task)
     routed_sources.append("global")
-    async for chunk in _yield_wrapper(
+    async for event in _yield_wrapper(
       f"Routed to sources: {routed_sources}",
-      f"{STATUS_PREFIX} Routing done, target sources: {routed_sources}\\n",
+      ChatEvent(
+        ChatEventKind.STATUS, f"Routing done, target sources: {routed_sources}\\n"
+      ),
     ):
-      yield chunk
+      yield event
     logger.debug(f"Search strategy: {self.search_strategy}")
 
     # RETRIEVAL STATUS
-    all_results = []
-    seen_chunk_ids = set()
+    # Every source is searched and reranked concurrently, status is streamed as
+    # each one finishes, then quotas and dedup are applied in routed order.
+    # A pending reflection is awaited alongside, an irrelevant query stops the
+    # retrieval and is answered without context.
+    irrelevant = (
+      reflect_task is not None
+      and reflect_task.done()
+      and self._is_irrelevant(reflect_task)
+    )
+    if irrelevant:
+      routed_sources = []
     for source in routed_sources:
-      async for chunk in _yield_wrapper(
+      async for event in _yield_wrapper(
         f"Retrieving from {source}...",
-        f"{STATUS_PREFIX} Retrieving from {source}...\\n",
+        ChatEvent(ChatEventKind.STATUS, f"Retrieving from {source}...\\n"),
       ):
-        yield chunk
-      if source != "global":
-        filter_expr = f'source == "{source}"'
-      else:
-        filter_expr = None
-      source_results = await self.hybrid_retriever.retrieve(
-        question=enhanced_query,
-        config=SearchConfig(
-          limit=self.limit,
-          output_fields=["*"],
-          filter_expr=filter_expr,
+        yield event
+    if encode_task is not None:
+      query_embedding = await encode_task
+      # The sources of an irrelevant query are cleared, they are not its routes
+      if cache_embedding is not None and not irrelevant:
+        enhance_route_cache.store(
+          cache_embedding,
+          (enhanced_query, routed_sources[:-1], query_embedding),
+        )
+    retrieval_tasks = await self._start_retrieval(
+      routed_sources, enhanced_query, query_embedding
+    )
+    source_reranked_map = {}
+    pending = set(retrieval_tasks)
+    if reflect_task is not None and not irrelevant:
+      pending.add(reflect_task)
+    try:
+      while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if reflect_task in done and self._is_irrelevant(reflect_task):
+          irrelevant = True
+          break
+        for finished in done:
+          if finished is reflect_task:
+            continue
+          source, source_reranked = finished.result()
+          source_reranked_map[source] = source_reranked
+          async for event in _yield_wrapper(
+            f"Retrieved {len(source_reranked)} candidates from {source}",
+            ChatEvent(
+              ChatEventKind.STATUS,
+              f"Retrieved {len(source_reranked)} candidates from {source}\\n",
+            ),
+          ):
+            yield event
+    finally:
+      for task in retrieval_tasks:
+        task.cancel()
+    if irrelevant:
+      routed_sources = []
+      async for event in _yield_wrapper(
+        "Reflection: irrelevant query, skip retrieval",
+        ChatEvent(
+          ChatEventKind.STATUS, "Irrelevant query, answering without context\\n"
         ),
-      )
-      source_reranked = await run_in_threadpool(
-        self.reranker.rerank,
-        query=enhanced_query,
-        results=source_results,
-      )
+      ):
+        yield event
+
+    if self.rerank_mode == "global" and not irrelevant:
+      async for event in _yield_wrapper(
+        "Reranking merged candidates...",
+        ChatEvent(ChatEventKind.STATUS, "Reranking merged candidates...\\n"),
+      ):
+        yield event
+      source_reranked_map = await self._rerank_pool(enhanced_query, source_reranked_map)
+
+    all_results = []
+    seen_chunk_ids = set()
+    for source in routed_sources:
       source_topk = []
-      for result in source_reranked[: self.search_strategy[source]]:
+      for result in source_reranked_map[source][: self.search_strategy[source]]:
         chunk_id = result.get("id")
         if chunk_id not in seen_chunk_ids:
           source_topk.append(result)
           seen_chunk_ids.add(chunk_id)
       all_results.extend(source_topk)
-      async for chunk in _yield_wrapper(
+      async for event in _yield_wrapper(
         f"Retrieved {len(source_topk)} unique chunks from {source}",
-        f"{STATUS_PREFIX} Retrieved {len(source_topk)} chunks from {source}\\n",
+        ChatEvent(
+          ChatEventKind.STATUS, f"Retrieved {len(source_topk)} chunks from {source}\\n"
+        ),
       ):
-        yield chunk
+        yield event
 
-    async for chunk in _yield_wrapper(
+    async for event in _yield_wrapper(
       f"Total unique chunks retrieved: {len(all_results)}",
-      f"{STATUS_PREFIX} Total unique chunks retrieved: {len(all_results)}\\n",
+      ChatEvent(
+        ChatEventKind.STATUS, f"Total unique chunks retrieved: {len(all_results)}\\n"
+      ),
     ):
-      yield chunk
+      yield event
     if self.test:
-      # Rerank all chunks
-      all_reranked = await run_in_threadpool(
-        self.reranker.rerank,
-        query=enhanced_query,
-        results=all_results,
-      )
+      if self.rerank_mode == "global":
+        # Already scored against the same query by the pooled rerank
+        all_reranked = sorted(all_results, key=lambda x: x["score"], reverse=True)
+      else:
+        # Rerank all chunks
+        all_reranked = await run_in_threadpool(
+          self.reranker.rerank,
+          query=enhanced_query,
+          results=all_results,
+        )
       chunks = [
         {"id": res["id"], "chunk": res["entity"]["chunk"]} for res in all_reranked
       ]
-      test_result = f"{TEST_PREFIX} Test mode, returning chunk IDs: \\n"
-      yield test_result
-      yield chunks
+      yield ChatEvent(ChatEventKind.TEST, chunks)
     extracted_topk_results = [res["entity"]["chunk"] for res in all_results]
     split_string = "\n"
     for i, chunk in enumerate(extracted_topk_results):
@@ -174,27 +464,31 @@ class ChatPipeline:
     results_text = results_text.replace("\r", "\\n")
     results_text = "\\n" + results_text + "\\n"
     logger.debug(f"Results text: {results_text}")
-    async for chunk in _yield_wrapper(
+    async for event in _yield_wrapper(
       f"Length of extracted topk results: {len(extracted_topk_results)}",
-      f"{STATUS_PREFIX} Reranking done, reflecting...",
+      ChatEvent(ChatEventKind.STATUS, "Reranking done, reflecting..."),
     ):
-      yield chunk
+      yield event
 
-    async for chunk in _yield_wrapper(
+    async for event in _yield_wrapper(
       "Returning context...",
-      f"{STATUS_PREFIX} Collecting context... {results_text}",
+      ChatEvent(ChatEventKind.CONTEXT, results_text),
     ):
-      yield chunk
+      yield event
 
     # Generate the answer
-    async for chunk in _yield_wrapper(
+    async for event in _yield_wrapper(
       "Generating answer...",
-      f"{ANSWER_PREFIX}\\n",
+      ChatEvent(ChatEventKind.ANSWER_START),
     ):
-      yield chunk
+      yield event
     stream = await self.async_generator(
       query=query, chunks=extracted_topk_results, history=history
     )
+    answer_tokens = []
     async for token in stream:
       token = token.replace("\n", "\\n")
-      yield token
+      answer_tokens.append(token)
+      yield ChatEvent(ChatEventKind.ANSWER, token)
+    if self.cache_answers and not history and cache_embedding is not None:
+      answer_cache.store(cache_embedding, (results_text, answer_tokens))
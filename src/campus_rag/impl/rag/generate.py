@@ -8,22 +8,19 @@ _HistoryLength = 4096
 
 
 def get_history_prompt(history: list[ChatMessage]) -> list[dict]:
-  history = history[::-1]
+  """The most recent messages of history that fit in _HistoryLength chars."""
   history_prompt = []
   length = 0
-  while True:
-    if len(history) == 0:
-      break
-    length += len(history[0].content)
+  for message in reversed(history):
+    length += len(message.content)
     if length > _HistoryLength:
       break
     history_prompt.append(
       {
-        "role": history[0].role,
-        "content": history[0].content,
+        "role": message.role,
+        "content": message.content,
       }
     )
-    history = history[1:]
   return history_prompt[::-1]
 
 
@@ -46,7 +43,7 @@ async def generate_answer(
 ## Context ##
 {chunks}
 ## Term explanation ##
-{get_keyword_explain("./data/keywords.json")}
+{get_keyword_explain("./data/keywords.json", query)}
 ## Query ##
 {query}
 """,
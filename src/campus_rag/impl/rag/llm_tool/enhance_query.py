@@ -14,7 +14,7 @@ async def enhance_query(query: str, keyword_path: str) -> str:
   """
   logger.info("Enhancing query...")
 
-  keyword_str = get_keyword_explain(keyword_path)
+  keyword_str = get_keyword_explain(keyword_path, query)
   prompt_content = {
     "role": "user",
     "content": f"""
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from campus_rag.impl.rag.llm_tool.enhance_query import enhance_query
+from campus_rag.impl.rag.llm_tool.route import route_query, source_list
+from campus_rag.utils.keyword_explain import get_keyword_explain
+from campus_rag.utils.llm import llm_chat_async, parse_as_json
+
+logger = logging.getLogger(__name__)
+
+
+async def enhance_and_route(query: str, keyword_path: str) -> tuple[str, list[str]]:
+  """Enhance the query and route it in a single LLM call.
+  Falls back to `enhance_query` and `route_query` (run concurrently) if the
+  response can not be parsed.
+  Args:
+    query: The original query.
+    keyword_path: Path to the keyword file.
+  Return:
+    The enhanced query and the list of routed sources.
+  """
+  keyword_str = get_keyword_explain(keyword_path, query)
+  source_str = "\n".join(f"- {name}: {desc}" for name, desc in source_list.items())
+  prompt_content = {
+    "role": "user",
+    "content": f"""
+    ## Instruction ##
+    完成两个任务：
+    1. 根据以下关键词和它们的解释，增强用户的查询。如果用户的问题中包含相关的关键词，提供他们的解释到问题中，否则不要添加任何解释。
+    增强查询时不要增加添加无关的信息，不能改变查询原本的意思。
+    2. 根据各个数据源的说明，将用户的查询路由到对应的数据源，一个查询可以对应到单个或多个数据源。
+    ## Keywords and Explanations ##
+    {keyword_str}
+    ## Sources ##
+    {source_str}
+    ## Query ##
+    {query}
+    ## Output ##
+    只输出一个json对象，不要输出任何其他内容或解释信息：
+    {{"query": "<增强后的查询>", "sources": ["source1", "source2"]}}
+    """,
+  }
+  response = await llm_chat_async([prompt_content])
+  logger.debug(f"Enhance and route LLM response: {response}")
+  try:
+    result = parse_as_json(response)
+    enhanced_query = result["query"].strip()
+    sources = [source for source in source_list if source in result["sources"]]
+    if enhanced_query:
+      return enhanced_query, sources
+  except Exception as e:
+    logger.error(f"Failed to parse enhance and route response: {e}")
+  enhanced_query, sources = await asyncio.gather(
+    enhance_query(query, keyword_path), route_query(query)
+  )
+  return enhanced_query, sources
@@ -1,11 +1,10 @@
+import asyncio
 import logging
-import json
 from enum import Enum
-import time
 from pydantic import BaseModel
 from typing import List
 from campus_rag.constants.prompt import SYSTEM_PROMPT
-from campus_rag.utils.llm import llm_chat_async, Message
+from campus_rag.utils.llm import llm_chat_async, parse_as_json, Message
 from campus_rag.utils.keyword_explain import get_keyword_explain
 
 logger = logging.getLogger(__name__)
@@ -32,19 +31,25 @@ class ReflectionResult(BaseModel):
 
 async def reflect_query(query: str, context: List[str], system_prompt: Message) -> dict:
   """
-  A non-async version that returns a dictionary instead of a structured model.
-  Useful for direct script execution and testing.
+  Classify the query, optionally against retrieved context passages.
+  Without context it only decides whether the query needs the knowledge base,
+  so it can run concurrently with retrieval.
 
   :param query: The user's question
-  :param context: List of context passages relevant to the query
+  :param context: List of context passages relevant to the query, may be empty
   :return: A dictionary with category and explanation
   """
-  time.sleep(1)
   logger.info("Reflecting on query and context...")
 
-  context_text = "\n".join(
-    [f"Passage {i + 1}: {ctx[:512]}" for i, ctx in enumerate(context)]
-  )
+  context_section = ""
+  if context:
+    context_text = "\n".join(
+      [f"Passage {i + 1}: {ctx[:512]}" for i, ctx in enumerate(context)]
+    )
+    context_section = f"""
+        ## Context Passages ##
+        {context_text}
+        """
 
   prompt_content = {
     "role": "user",
@@ -59,11 +64,8 @@ async def reflect_query(query: str, context: List[str], system_prompt: Message)
         {query}
         
         ## Term explanation ##
-        {get_keyword_explain("./data/keywords.json")}
-        
-        ## Context Passages ##
-        {context_text}
-        
+        {get_keyword_explain("./data/keywords.json", query)}
+        {context_section}
         Return your analysis in JSON format with the following structure:
         {{
             "category": <category number (1, 2)>,
@@ -77,35 +79,12 @@ async def reflect_query(query: str, context: List[str], system_prompt: Message)
   response = await llm_chat_async([system_prompt, prompt_content])
 
   try:
-    result = json.loads(response)
+    result = parse_as_json(response)
+    ReflectionCategory(int(result["category"]))
     logger.info(
       f"Reflection result: Category {result['category']} - {result['explanation']}"
     )
     return result
-  except json.JSONDecodeError:
-    logger.info("Initial JSON parsing failed, trying to clean response")
-    cleaned_response = response.strip()
-
-    if cleaned_response.startswith("```json"):
-      cleaned_response = cleaned_response.replace("```json", "", 1).strip()
-    elif cleaned_response.startswith("```"):
-      cleaned_response = cleaned_response.replace("```", "", 1).strip()
-
-    if cleaned_response.endswith("```"):
-      cleaned_response = cleaned_response.rsplit("```", 1)[0].strip()
-
-    try:
-      result = json.loads(cleaned_response)
-      logger.info(
-        f"Reflection result after cleaning: Category {result['category']} - {result['explanation']}"
-      )
-      return result
-    except Exception as e:
-      logger.error(f"Error parsing reflection result after cleaning: {e}")
-      return {
-        "category": 2,
-        "explanation": "Failed to analyze the query and context properly.",
-      }
   except Exception as e:
     logger.error(f"Error parsing reflection result: {e}")
     return {
@@ -120,7 +99,7 @@ if __name__ == "__main__":
     "南京大学仙林校区的图书馆周一至周五开放时间为8:00-22:00，周末为9:00-21:00。",
     "南京大学有多个校区，包括仙林校区、鼓楼校区和浦口校区。",
   ]
-  result = reflect_query(query, context, SYSTEM_PROMPT)
+  result = asyncio.run(reflect_query(query, context, SYSTEM_PROMPT))
   print(f"Category: {result['category']}")
   print(f"Explanation: {result['explanation']}")
   query = "南京大学的图书馆开放时间是什么时候？"
@@ -128,7 +107,7 @@ if __name__ == "__main__":
     "67是刘钦",
     "6f是刘峰",
   ]
-  result = reflect_query(query, context, SYSTEM_PROMPT)
+  result = asyncio.run(reflect_query(query, context, SYSTEM_PROMPT))
   print(f"Category: {result['category']}")
   print(f"Explanation: {result['explanation']}")
   query = "石守谦怎么样"
@@ -136,6 +115,6 @@ if __name__ == "__main__":
     "石守谦是南京大学老师",
     "6f是刘峰",
   ]
-  result = reflect_query(query, context, SYSTEM_PROMPT)
+  result = asyncio.run(reflect_query(query, context, SYSTEM_PROMPT))
   print(f"Category: {result['category']}")
   print(f"Explanation: {result['explanation']}")
@@ -10,15 +10,92 @@ source_list = {
   "manual": "南京大学的学生手册数据，包含学校的规章制度、学籍管理等信息",
 }
 
+# Keywords that point to one source, collected from the source descriptions
+# above and from logged queries, with their weight: 2 for a keyword that is
+# decisive on its own, 1 for one that also shows up in questions for other
+# sources (e.g. "学分" or "挂科" in rules questions) and needs a second hit.
+route_keywords = {
+  "course": {
+    "课程": 1,
+    "学分": 1,
+    "教材": 2,
+    "参考书": 2,
+    "选修": 1,
+    "必修": 1,
+    "通识": 1,
+    "开课": 2,
+    "上课": 1,
+    "绩点": 1,
+    "给分": 2,
+  },
+  "teacher": {
+    "老师": 1,
+    "教授": 1,
+    "讲师": 1,
+    "导师": 2,
+    "职称": 2,
+    "研究方向": 2,
+    "做什么研究": 2,
+    "课题组": 2,
+    "实验室": 1,
+  },
+  "manual": {
+    "学生手册": 2,
+    "学籍": 2,
+    "规章": 2,
+    "规定": 1,
+    "处分": 2,
+    "休学": 2,
+    "复学": 2,
+    "退学": 2,
+    "转专业": 2,
+    "补考": 2,
+    "重修": 1,
+    "缓考": 2,
+    "挂科": 1,
+    "申诉": 1,
+    "学位": 1,
+    "毕业": 1,
+    "请假": 1,
+  },
+}
+# Keyword weight a source needs for a local route
+LOCAL_ROUTE_MIN_SCORE = 2
+
+
+def local_route(query: str) -> list[str] | None:
+  """Route the query by keywords, without calling the LLM.
+  Args:
+    query: The original query.
+  Return:
+    The routed sources if exactly one source matches, with a keyword weight of
+    at least LOCAL_ROUTE_MIN_SCORE, otherwise None, meaning the query is
+    ambiguous (or not specific enough) and should be routed by LLM.
+  """
+  query = query.lower()
+  scores = {
+    source: sum(weight for keyword, weight in keywords.items() if keyword in query)
+    for source, keywords in route_keywords.items()
+  }
+  matched = [source for source, score in scores.items() if score > 0]
+  if len(matched) == 1 and scores[matched[0]] >= LOCAL_ROUTE_MIN_SCORE:
+    return matched
+  return None
+
 
-async def route_query(query: str) -> list[str]:
+async def route_query(query: str, local_first: bool = True) -> list[str]:
   """Route the query to the appropriate source based on the provided source type.
   Args:
     query: The original query.
-    source: The source type to route the query to.
+    local_first: Try `local_route` before asking the LLM.
   Return:
     The response from the LLM for the routed query.
   """
+  if local_first:
+    sources = local_route(query)
+    if sources is not None:
+      logger.debug(f"Routed locally to: {sources}")
+      return sources
 
   prompt_content = {
     "role": "user",
@@ -1,43 +1,60 @@
 import logging
 import asyncio
+import time
 import uuid
-from typing import Any, AsyncGenerator
-from campus_rag.constants.conversation import ANSWER_PREFIX
-from campus_rag.domain.rag.po import Query
+from typing import AsyncGenerator
+from fastapi import HTTPException
+from campus_rag.constants.conversation import (
+  TASK_ABANDON_GRACE,
+  TASK_SUBSCRIBER_CHECK_INTERVAL,
+)
+from campus_rag.domain.rag.po import ChatEventKind, Query
 from campus_rag.domain.user.po import User
-from ..user.conversation import add_message_to_conversation, get_conversation_by_id
+from ..user.conversation import add_message_to_conversation, get_recent_history
 from .chat_pipeline import ChatPipeline
+from .task_backend import create_task_backend
 
 logger = logging.getLogger(__name__)
-# Task map from task id to task information (queue).
-# TODO: add a lock here
-_task_dict: dict[str, dict[str, Any]] = {}
+# Status and result chunks of every task
+task_backend = create_task_backend()
+# Keeps the background runs referenced until they are done
+_background_tasks: set[asyncio.Task] = set()
 
 
-async def run_pipeline_and_queue_results(task_id: str, query: str, history: list):
-  """Runs the RAG pipeline and puts results into the task's queue."""
+async def run_pipeline_and_queue_results(
+  task_id: str, query: str, history: list, user: User, conversation_id: str
+):
+  """Runs the RAG pipeline and appends results to the task backend."""
   chat_pipeline = ChatPipeline()
-  metainfo = ""
+  # Rendered chunks and answer tokens, joined once the pipeline is done
+  chunks = []
+  answer_tokens = []
+  status = "completed"
   try:
-    async for chunk in chat_pipeline.start(query, history):
+    async for event in chat_pipeline.start(query, history):
+      chunk = event.render()
       logger.debug(f"Chunk received: {chunk}")
-      metainfo = metainfo + chunk
-      await _task_dict[task_id]["queue"].put(chunk)
+      chunks.append(chunk)
+      if event.kind == ChatEventKind.ANSWER:
+        answer_tokens.append(event.content)
+      await task_backend.append(task_id, chunk)
+      await task_backend.wait_for_readers(task_id)
       await asyncio.sleep(0)
-
-    await _task_dict[task_id]["queue"].put(None)
-    _task_dict[task_id]["status"] = "completed"
+  except asyncio.CancelledError:
+    # Abandoned by every client, the pipeline stopped at its current stage
+    logger.info(f"Task {task_id} cancelled after {len(answer_tokens)} tokens")
+    status = "cancelled"
   except Exception as e:
-    _task_dict[task_id]["status"] = "error"
-    _task_dict[task_id]["error_message"] = str(e)
     # Signal error completion
-    await _task_dict[task_id]["queue"].put(None)
+    await task_backend.finish(task_id, "error", str(e))
+    return
+  await task_backend.finish(task_id, status)
+  if status == "cancelled" and not answer_tokens:
     return
 
-  # Persist the final answer
-  final_answer = metainfo.split(ANSWER_PREFIX)[-1].strip()
-  user = _task_dict[task_id]["user"]
-  conversation_id = _task_dict[task_id]["conversation_id"]
+  # Persist the final answer, or the part generated before the cancellation
+  metainfo = "".join(chunks)
+  final_answer = "".join(answer_tokens).strip()
   await add_message_to_conversation(
     user,
     conversation_id,
@@ -54,49 +71,82 @@ async def start_pipeline(query: Query, user: User):
   # Add user message immediately
 
   task_id = str(uuid.uuid4())
-  conversation = await get_conversation_by_id(user, query.conversation_id)
-  history = conversation.messages
-  await add_message_to_conversation(
-    user, query.conversation_id, content=query.query, role="user"
-  )
+  history = await get_recent_history(user, query.conversation_id)
 
-  # Create a queue for this task
-  result_queue = asyncio.Queue()
-  _task_dict[task_id] = {
-    "queue": result_queue,
-    "status": "running",
-    "error_message": None,
-    "user": user,  # Store context for adding assistant message later
-    "conversation_id": query.conversation_id,
-  }
+  if not await task_backend.create(task_id):
+    raise HTTPException(status_code=503, detail="Too many running tasks")
+  try:
+    await add_message_to_conversation(
+      user, query.conversation_id, content=query.query, role="user"
+    )
+  except Exception as e:
+    # The task never runs, free its slot instead of leaving it "running"
+    detail = e.detail if isinstance(e, HTTPException) else str(e)
+    await task_backend.finish(task_id, "error", detail)
+    raise
 
   # Start the pipeline in the background
-  asyncio.create_task(run_pipeline_and_queue_results(task_id, query.query, history))
+  run_task = asyncio.create_task(
+    run_pipeline_and_queue_results(
+      task_id, query.query, history, user, query.conversation_id
+    )
+  )
+  watch_task = asyncio.create_task(_cancel_when_abandoned(task_id, run_task))
+  run_task.add_done_callback(lambda _: watch_task.cancel())
+  for task in (run_task, watch_task):
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
   return task_id
 
 
-def task_exists(task_id: str) -> bool:
+async def _cancel_when_abandoned(task_id: str, run_task: asyncio.Task):
+  """Cancels the run once no client streamed it for TASK_ABANDON_GRACE seconds."""
+  last_seen = time.time()
+  while not run_task.done():
+    await asyncio.sleep(TASK_SUBSCRIBER_CHECK_INTERVAL)
+    try:
+      if await task_backend.has_subscribers(task_id):
+        last_seen = time.time()
+        continue
+    except Exception as e:
+      logger.error(f"Failed to check the clients of task {task_id}: {e}")
+      continue
+    if time.time() - last_seen > TASK_ABANDON_GRACE:
+      logger.info(f"Task {task_id} has no client, cancelling it")
+      run_task.cancel()
+      return
+
+
+async def task_exists(task_id: str) -> bool:
   """
   Checks if a task with the given ID exists.
   """
-  return task_id in _task_dict and (
-    _task_dict[task_id]["status"] == "running"
-    or _task_dict[task_id]["status"] == "completed"
-  )
+  task_status = await task_backend.get_status(task_id)
+  return task_status is not None and task_status[0] in ("running", "completed")
 
 
-async def get_rag_stream(task_id: int) -> AsyncGenerator:
+async def get_rag_stream(task_id: str, offset: int = 0) -> AsyncGenerator:
   """
-  Streams the results of a running RAG pipeline task using SSE.
+  Streams the results of a RAG pipeline task using SSE.
+  Any number of clients can stream the same task, each from its own offset.
+
+  Args:
+      task_id (str): The task ID.
+      offset (int): Index of the first chunk to stream, a reconnecting client
+        resumes after the last chunk it got.
   """
-  task_info = _task_dict[task_id]
-  result_queue = task_info["queue"]
-  while True:
-    chunk = await result_queue.get()
-    # logger.debug("---- Chunk sent!!! ----")
-    if chunk is None:
-      if task_info["status"] == "error":
-        yield f"Error: {task_info.get('error_message', 'Unknown error')}"
-      break
-    yield chunk
+  subscription = task_backend.subscribe(task_id, offset)
+  try:
+    async for chunk in subscription:
+      yield chunk
+  finally:
+    await subscription.aclose()
+  task_status = await task_backend.get_status(task_id)
+  if task_status is not None and task_status[0] == "error":
+    yield f"Error: {task_status[1] or 'Unknown error'}"
+
+
+async def get_task_counts() -> dict[str, int]:
+  """Live (and, for the in-memory backend, finished) task counts."""
+  return await task_backend.counts()
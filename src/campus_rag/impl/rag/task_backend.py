@@ -0,0 +1,266 @@
+import logging
+import time
+import uuid
+from abc import abstractmethod
+from typing import AsyncGenerator, Optional
+
+from campus_rag.constants.conversation import (
+  TASK_ABANDON_GRACE,
+  TASK_BACKEND,
+  TASK_HEARTBEAT_TTL,
+  TASK_KEY_PREFIX,
+  TASK_MAX_LAG,
+  TASK_MAX_SIZE,
+  TASK_STREAM_BLOCK_MS,
+  TASK_STREAM_READ_COUNT,
+  TASK_TTL,
+)
+from campus_rag.infra.redis import async_redis_client, async_redis_stream_client
+from campus_rag.utils.broadcast import ReplayBuffer
+from .task_registry import TaskRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class TaskBackend:
+  """
+  Status and result chunks of the background pipeline tasks. The worker that
+  runs a task writes to it, any stream client reads from it.
+  """
+
+  @abstractmethod
+  async def create(self, task_id: str) -> bool:
+    """Registers a running task, False if no more tasks are accepted."""
+    pass
+
+  @abstractmethod
+  async def append(self, task_id: str, chunk: str):
+    """Appends a result chunk, only called by the worker running the task."""
+    pass
+
+  @abstractmethod
+  async def finish(
+    self, task_id: str, status: str, error_message: Optional[str] = None
+  ):
+    """Marks a task "completed", "error" or "cancelled" and ends its chunks."""
+    pass
+
+  @abstractmethod
+  async def get_status(self, task_id: str) -> Optional[tuple[str, Optional[str]]]:
+    """Returns (status, error message), None if the task is unknown."""
+    pass
+
+  @abstractmethod
+  def subscribe(self, task_id: str, offset: int = 0) -> AsyncGenerator[str, None]:
+    """Yields the chunks of a task from `offset` on, until it is finished."""
+    pass
+
+  @abstractmethod
+  async def has_subscribers(self, task_id: str) -> bool:
+    """Whether any stream client is reading the task."""
+    pass
+
+  async def wait_for_readers(self, task_id: str):
+    """Backpressure, the worker waits here while stream clients lag behind."""
+    pass
+
+  @abstractmethod
+  async def counts(self) -> dict[str, int]:
+    pass
+
+
+class InMemoryTaskBackend(TaskBackend):
+  """Tasks live in this process, /query and /stream must hit the same worker."""
+
+  def __init__(self, max_size=TASK_MAX_SIZE, ttl=TASK_TTL):
+    self.registry = TaskRegistry(max_size=max_size, ttl=ttl)
+
+  async def create(self, task_id: str) -> bool:
+    return self.registry.add(task_id, {"buffer": ReplayBuffer()})
+
+  async def append(self, task_id: str, chunk: str):
+    self.registry.get(task_id)["buffer"].append(chunk)
+
+  async def finish(
+    self, task_id: str, status: str, error_message: Optional[str] = None
+  ):
+    self.registry.finish(task_id, status, error_message)
+    task_info = self.registry.get(task_id)
+    if task_info is not None:
+      task_info["buffer"].close()
+
+  async def get_status(self, task_id: str) -> Optional[tuple[str, Optional[str]]]:
+    task_info = self.registry.get(task_id)
+    if task_info is None:
+      return None
+    return task_info["status"], task_info.get("error_message")
+
+  async def subscribe(self, task_id: str, offset: int = 0) -> AsyncGenerator[str, None]:
+    task_info = self.registry.get(task_id)
+    if task_info is None:
+      return
+    subscription = task_info["buffer"].subscribe(offset)
+    try:
+      async for chunk in subscription:
+        yield chunk
+    finally:
+      # Leave the buffer as soon as the client is gone
+      await subscription.aclose()
+
+  async def has_subscribers(self, task_id: str) -> bool:
+    task_info = self.registry.get(task_id)
+    return task_info is not None and task_info["buffer"].subscribers > 0
+
+  async def wait_for_readers(self, task_id: str):
+    task_info = self.registry.get(task_id)
+    if task_info is not None:
+      await task_info["buffer"].wait_for_readers(TASK_MAX_LAG, TASK_ABANDON_GRACE)
+
+  async def counts(self) -> dict[str, int]:
+    return self.registry.counts()
+
+
+class RedisStreamsTaskBackend(TaskBackend):
+  """
+  Tasks live in redis, so /query and /stream can hit different workers:
+    <prefix><id>          hash of status and error message
+    <prefix><id>:stream   stream of chunks, the i-th chunk has the id 0-(i+1)
+    <prefix><id>:watchers sorted set of stream clients by last heartbeat
+    <prefix>running       sorted set of running task ids by start time
+  Keys expire `ttl` seconds after the task is created and again after it
+  finished. Chunks are written as they come, without backpressure.
+  """
+
+  def __init__(
+    self,
+    max_size=TASK_MAX_SIZE,
+    ttl=TASK_TTL,
+    prefix=TASK_KEY_PREFIX,
+    redis=async_redis_client,
+    stream_redis=async_redis_stream_client,
+  ):
+    """
+    Args:
+      redis: Client of every command but the blocking stream reads.
+      stream_redis: Client of the blocking stream reads, with its own pool.
+    """
+    self.redis = redis
+    self.stream_redis = stream_redis
+    self.max_size = max_size
+    self.ttl = ttl
+    self.prefix = prefix
+    self.running_key = f"{prefix}running"
+    # Task id -> number of chunks appended by this worker
+    self._lengths: dict[str, int] = {}
+
+  def _key(self, task_id: str) -> str:
+    return f"{self.prefix}{task_id}"
+
+  def _stream_key(self, task_id: str) -> str:
+    return f"{self.prefix}{task_id}:stream"
+
+  def _watchers_key(self, task_id: str) -> str:
+    return f"{self.prefix}{task_id}:watchers"
+
+  async def _heartbeat(self, task_id: str, watcher: str):
+    async with self.redis.pipeline(transaction=False) as pipe:
+      pipe.zadd(self._watchers_key(task_id), {watcher: time.time()})
+      pipe.expire(self._watchers_key(task_id), self.ttl)
+      await pipe.execute()
+
+  async def create(self, task_id: str) -> bool:
+    now = time.time()
+    # A worker that died mid-task never removes it, so old entries expire
+    await self.redis.zremrangebyscore(self.running_key, "-inf", now - self.ttl)
+    if await self.redis.zcard(self.running_key) >= self.max_size:
+      logger.warning(f"Task backend full: {self.max_size} running tasks")
+      return False
+    async with self.redis.pipeline(transaction=False) as pipe:
+      pipe.hset(self._key(task_id), mapping={"status": "running", "error_message": ""})
+      pipe.expire(self._key(task_id), self.ttl)
+      pipe.zadd(self.running_key, {task_id: now})
+      await pipe.execute()
+    self._lengths[task_id] = 0
+    return True
+
+  async def append(self, task_id: str, chunk: str):
+    self._lengths[task_id] += 1
+    stream_key = self._stream_key(task_id)
+    await self.redis.xadd(
+      stream_key, {"chunk": chunk}, id=f"0-{self._lengths[task_id]}"
+    )
+    if self._lengths[task_id] == 1:
+      await self.redis.expire(stream_key, self.ttl)
+
+  async def finish(
+    self, task_id: str, status: str, error_message: Optional[str] = None
+  ):
+    length = self._lengths.pop(task_id, 0)
+    stream_key = self._stream_key(task_id)
+    async with self.redis.pipeline(transaction=False) as pipe:
+      pipe.hset(
+        self._key(task_id),
+        mapping={"status": status, "error_message": error_message or ""},
+      )
+      # End marker, readers stop at it
+      pipe.xadd(stream_key, {"end": "1"}, id=f"0-{length + 1}")
+      pipe.expire(self._key(task_id), self.ttl)
+      pipe.expire(stream_key, self.ttl)
+      pipe.zrem(self.running_key, task_id)
+      await pipe.execute()
+
+  async def get_status(self, task_id: str) -> Optional[tuple[str, Optional[str]]]:
+    task_info = await self.redis.hgetall(self._key(task_id))
+    if not task_info:
+      return None
+    return task_info["status"], task_info["error_message"] or None
+
+  async def subscribe(self, task_id: str, offset: int = 0) -> AsyncGenerator[str, None]:
+    stream_key = self._stream_key(task_id)
+    # Stream ids are exclusive, 0-offset is the id of the chunk before `offset`
+    last_id = f"0-{offset}"
+    watcher = str(uuid.uuid4())
+    try:
+      while True:
+        # Every read refreshes the heartbeat, reads return at least every
+        # TASK_STREAM_BLOCK_MS
+        await self._heartbeat(task_id, watcher)
+        response = await self.stream_redis.xread(
+          {stream_key: last_id},
+          count=TASK_STREAM_READ_COUNT,
+          block=TASK_STREAM_BLOCK_MS,
+        )
+        if not response:
+          # Nothing new for a while, stop if the task expired meanwhile
+          if not await self.redis.exists(self._key(task_id)):
+            return
+          continue
+        for entry_id, fields in response[0][1]:
+          if "end" in fields:
+            return
+          last_id = entry_id
+          yield fields["chunk"]
+    finally:
+      await self.redis.zrem(self._watchers_key(task_id), watcher)
+
+  async def has_subscribers(self, task_id: str) -> bool:
+    alive_since = time.time() - TASK_HEARTBEAT_TTL
+    return await self.redis.zcount(self._watchers_key(task_id), alive_since, "+inf") > 0
+
+  async def counts(self) -> dict[str, int]:
+    now = time.time()
+    live = await self.redis.zcount(self.running_key, now - self.ttl, "+inf")
+    return {"live": live, "max_size": self.max_size}
+
+
+def create_task_backend(name: str = TASK_BACKEND) -> TaskBackend:
+  """
+  Args:
+    name: "memory" keeps tasks in this worker, "redis" shares them between
+      workers through redis streams.
+  """
+  if name == "memory":
+    return InMemoryTaskBackend()
+  if name == "redis":
+    return RedisStreamsTaskBackend()
+  raise ValueError(f"Unknown task backend: {name}")
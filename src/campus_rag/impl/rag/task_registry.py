@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from campus_rag.constants.conversation import TASK_MAX_SIZE, TASK_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class TaskRegistry:
+  """
+  Task id -> task information of the background pipeline runs.
+  Finished (completed or errored) tasks are kept for `ttl` seconds so clients
+  can still read their results, then evicted. Running tasks are never evicted,
+  once `max_size` tasks are running no new task is accepted.
+  """
+
+  def __init__(self, max_size=TASK_MAX_SIZE, ttl=TASK_TTL):
+    """
+    Args:
+      max_size: Max number of tasks, running and finished.
+      ttl: Seconds a finished task is kept.
+    """
+    self.max_size = max_size
+    self.ttl = ttl
+    self._tasks: dict[str, dict[str, Any]] = {}
+    # Finished task id -> time it finished, oldest first
+    self._finished: OrderedDict[str, float] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def _evict_expired(self):
+    deadline = time.time() - self.ttl
+    while self._finished:
+      task_id, finished_at = next(iter(self._finished.items()))
+      if finished_at > deadline:
+        break
+      self._finished.popitem(last=False)
+      del self._tasks[task_id]
+
+  def add(self, task_id: str, info: dict[str, Any]) -> bool:
+    """Registers a running task.
+    Returns:
+      False if the registry is full of running tasks.
+    """
+    with self._lock:
+      self._evict_expired()
+      if len(self._tasks) >= self.max_size:
+        if not self._finished:
+          logger.warning(f"Task registry full: {self.max_size} running tasks")
+          return False
+        # Make room by dropping the oldest finished task before its ttl
+        old_id, _ = self._finished.popitem(last=False)
+        del self._tasks[old_id]
+      info["status"] = "running"
+      self._tasks[task_id] = info
+      return True
+
+  def get(self, task_id: str) -> Optional[dict[str, Any]]:
+    with self._lock:
+      self._evict_expired()
+      return self._tasks.get(task_id)
+
+  def finish(self, task_id: str, status: str, error_message: Optional[str] = None):
+    """Marks a task "completed", "error" or "cancelled", starting its ttl."""
+    with self._lock:
+      info = self._tasks.get(task_id)
+      if info is None or task_id in self._finished:
+        return
+      info["status"] = status
+      info["error_message"] = error_message
+      self._finished[task_id] = time.time()
+
+  def counts(self) -> dict[str, int]:
+    """Number of live (running) and finished tasks, by status."""
+    with self._lock:
+      self._evict_expired()
+      counts = {"live": len(self._tasks) - len(self._finished)}
+      for status in ("completed", "error", "cancelled"):
+        counts[status] = 0
+      for task_id in self._finished:
+        counts[self._tasks[task_id]["status"]] += 1
+      counts["max_size"] = self.max_size
+      return counts
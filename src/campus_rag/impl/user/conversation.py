@@ -1,14 +1,21 @@
 from pydantic import UUID4
-from campus_rag.domain.rag.po import Conversation, ChatMessage, SortedBy
+from campus_rag.domain.rag.po import Conversation, ChatMessage, SortedBy, sorted_columns
 from campus_rag.domain.rag.vo import ConversationView
 from campus_rag.domain.user.po import User
 from campus_rag.infra.sqlite import conversation as db
 from fastapi import HTTPException
 from typing import Optional
+from campus_rag.constants.conversation import HISTORY_WINDOW_SIZE, TITLE_QUEUE_SIZE
 from campus_rag.utils.llm import llm_chat_async
+import asyncio
+import base64
+import json
 import logging
 
 logger = logging.getLogger(__name__)
+# (conversation id, first user message) of the titles to generate
+_title_queue: Optional[asyncio.Queue] = None
+_title_worker: Optional[asyncio.Task] = None
 
 
 async def create_conversation(user: User) -> ConversationView:
@@ -17,37 +24,99 @@ async def create_conversation(user: User) -> ConversationView:
 
 
 async def get_conversation_by_id(
-  user: User, conversation_id: str | UUID4
+  user: User, conversation_id: str | UUID4, with_messages: bool = True
 ) -> Conversation:
   """Fetches a specific conversation for a user, including its messages."""
 
-  conversation = await db.find_conversation_by_id(user.id, conversation_id)
+  conversation = await db.find_conversation_by_id(
+    user.id, conversation_id, with_messages=with_messages
+  )
   if not conversation:
     raise HTTPException(status_code=404, detail="Conversation not found")
 
   return conversation
 
 
+def _encode_cursor(sorted_by: SortedBy, sort_value: float, conversation_id: str) -> str:
+  return base64.urlsafe_b64encode(
+    json.dumps([sorted_by.value, sort_value, conversation_id]).encode()
+  ).decode()
+
+
+def _decode_cursor(cursor: str, sorted_by: SortedBy) -> tuple[float, str]:
+  """Raises 400 unless the cursor was issued for the same `sorted_by`."""
+  try:
+    cursor_sorted_by, sort_value, conversation_id = json.loads(
+      base64.urlsafe_b64decode(cursor)
+    )
+    after = float(sort_value), str(conversation_id)
+  except Exception:
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+  if cursor_sorted_by != sorted_by.value:
+    raise HTTPException(
+      status_code=400, detail=f"Cursor was issued for sorted_by={cursor_sorted_by}"
+    )
+  return after
+
+
 async def get_conversations(
   user: User,
   offset: int = 0,
   limit: int = 10,
   sorted_by: SortedBy = SortedBy.updated_reverse,
+  cursor: Optional[str] = None,
 ) -> list[ConversationView]:
-  """Fetches a list of conversations for a user with sorting and pagination."""
+  """Fetches a list of conversations for a user with sorting and pagination.
+  Args:
+    cursor: Cursor of the last conversation of the previous page, replaces
+      `offset` so deep pages cost the same as the first one.
+  """
+  after = _decode_cursor(cursor, sorted_by) if cursor is not None else None
   try:
     conversations = await db.find_conversations_by_user(
-      user.id, offset, limit, sorted_by
+      user.id, offset, limit, sorted_by, after=after
     )
-    return [ConversationView.fromVO(conv) for conv in conversations]
   except ValueError as e:
     raise HTTPException(status_code=400, detail=str(e))
+  sort_column = sorted_columns[sorted_by]
+  return [
+    ConversationView.fromVO(
+      conv,
+      cursor=_encode_cursor(
+        sorted_by, getattr(conv, sort_column), conv.conversation_id
+      ),
+    )
+    for conv in conversations
+  ]
+
+
+async def get_chat_history(
+  user: User,
+  conversation_id: str,
+  after_id: Optional[str] = None,
+  limit: Optional[int] = None,
+) -> list[ChatMessage]:
+  """Fetches the chat messages for a specific conversation.
+  Args:
+    after_id: Only the messages after the one with this id.
+    limit: Max number of messages, all of them if None.
+  """
+  conversation = await get_conversation_by_id(
+    user, conversation_id, with_messages=False
+  )
+  return await db.find_messages_by_conversation(
+    conversation.conversation_id, after_id=after_id, limit=limit
+  )
 
 
-async def get_chat_history(user: User, conversation_id: str) -> list[ChatMessage]:
-  """Fetches the chat messages for a specific conversation."""
-  conversation = await get_conversation_by_id(user, conversation_id)
-  return await db.find_messages_by_conversation(conversation.conversation_id)
+async def get_recent_history(
+  user: User, conversation_id: str, limit: int = HISTORY_WINDOW_SIZE
+) -> list[ChatMessage]:
+  """Fetches the most recent messages of a conversation, for the prompt."""
+  conversation = await get_conversation_by_id(
+    user, conversation_id, with_messages=False
+  )
+  return await db.find_recent_messages(conversation.conversation_id, limit)
 
 
 async def extract_title_from_content(content: str) -> str:
@@ -70,7 +139,38 @@ async def extract_title_from_content(content: str) -> str:
     return title
   except Exception as e:
     # If title extraction fails, use a fallback
-    return content[:20] + "..." if len(content) > 20 else content
+    return heuristic_title(content)
+
+
+def heuristic_title(content: str) -> str:
+  """Title made from the start of the first message, no LLM needed."""
+  return content[:20] + "..." if len(content) > 20 else content
+
+
+async def _generate_titles():
+  """Background worker, replaces the heuristic titles by LLM generated ones."""
+  while True:
+    conversation_id, content = await _title_queue.get()
+    try:
+      title = await extract_title_from_content(content)
+      await db.update_conversation_title(conversation_id, title)
+      logger.debug(f"Generated title for conversation {conversation_id}: {title}")
+    except Exception as e:
+      logger.error(f"Failed to generate title for {conversation_id}: {e}")
+    finally:
+      _title_queue.task_done()
+
+
+def schedule_title_generation(conversation_id: str, content: str):
+  """Queues the LLM title of a conversation, started on first use."""
+  global _title_queue, _title_worker
+  if _title_worker is None or _title_worker.done():
+    _title_queue = asyncio.Queue(maxsize=TITLE_QUEUE_SIZE)
+    _title_worker = asyncio.create_task(_generate_titles())
+  try:
+    _title_queue.put_nowait((conversation_id, content))
+  except asyncio.QueueFull:
+    logger.warning(f"Title queue full, keep the heuristic title of {conversation_id}")
 
 
 async def add_message_to_conversation(
@@ -82,21 +182,21 @@ async def add_message_to_conversation(
 ) -> ChatMessage:
   """Adds a new message to a conversation."""
 
-  new_message = await db.insert_message(
-    conversation_id, content, role, metainfo=metainfo
+  appended = await db.append_message(
+    user.id,
+    conversation_id,
+    content,
+    role,
+    metainfo=metainfo,
+    default_title=heuristic_title(content),
   )
+  if appended is None:
+    raise HTTPException(status_code=404, detail="Conversation not found")
+  new_message, needs_title = appended
 
-  conversation = await get_conversation_by_id(user, conversation_id)
-
-  # Generate title if it's the first user message and no title exists
-  if role == "user" and len(conversation.messages) == 1 and conversation.title is None:
-    title = await extract_title_from_content(content)
-    conversation.title = title
-    logger.debug(
-      f"Generated title for conversation {conversation.conversation_id}: {title}"
-    )
-    await db.update_conversation(conversation)
-
-  await db.update_conversation_time(conversation.conversation_id)
+  # First user message: the heuristic title is set already, the LLM one is
+  # generated in the background so the chat does not wait for it
+  if needs_title:
+    schedule_title_generation(conversation_id, content)
 
   return new_message
@@ -1,12 +1,14 @@
+import asyncio
 from pymilvus import (
   AnnSearchRequest,
   MilvusClient,
   WeightedRanker,
 )
-from typing import List
+from typing import List, Optional
 from campus_rag.infra.embedding import embedding_model, sparse_embedding_model
 from fastapi.concurrency import run_in_threadpool
-from campus_rag.domain.rag.po import SearchConfig
+from campus_rag.domain.rag.po import QueryEmbedding, SearchConfig
+from campus_rag.constants.milvus import SEARCH_LIMIT_MAX
 
 
 class HybridRetriever:
@@ -19,15 +21,29 @@ class HybridRetriever:
     self.collection_name = collection_name
     self.is_test = is_test
 
+  def _encode(self, query: str) -> QueryEmbedding:
+    return QueryEmbedding(
+      dense=embedding_model.encode(query, normalize_embeddings=True),
+      sparse=sparse_embedding_model([query])["sparse"][[0]],
+    )
+
+  async def encode(self, query: str) -> QueryEmbedding:
+    """Run the dense and sparse encoders once, the result can be passed to
+    every `retrieve` call made for the same query."""
+    return await run_in_threadpool(self._encode, query)
+
   def _hybrid_search(
     self,
     query: str,
     config: SearchConfig,
+    query_embedding: Optional[QueryEmbedding] = None,
   ) -> List[dict]:
     sparse_weight = config.sparse_weight
     dense_weight = config.dense_weight
-    query_dense_embedding = embedding_model.encode(query, normalize_embeddings=True)
-    query_sparse_embedding = sparse_embedding_model([query])["sparse"][[0]]
+    if query_embedding is None:
+      query_embedding = self._encode(query)
+    query_dense_embedding = query_embedding.dense
+    query_sparse_embedding = query_embedding.sparse
     dense_search_params = {"metric_type": "IP", "params": {}}
     expr = config.filter_expr
     limit = config.limit
@@ -60,9 +76,16 @@ class HybridRetriever:
     )[0]
     return res
 
-  async def retrieve(self, question: str, config: SearchConfig) -> List[dict]:
+  async def retrieve(
+    self,
+    question: str,
+    config: SearchConfig,
+    query_embedding: Optional[QueryEmbedding] = None,
+  ) -> List[dict]:
     # Search with filters
-    hybrid_results = await run_in_threadpool(self._hybrid_search, question, config)
+    hybrid_results = await run_in_threadpool(
+      self._hybrid_search, question, config, query_embedding
+    )
     # Delete the embedding and sparse_embedding fields from the results
     for result in hybrid_results:
       if "embedding" in result:
@@ -74,3 +97,80 @@ class HybridRetriever:
       if "sparse_embedding" in result["entity"]:
         del result["entity"]["sparse_embedding"]
     return hybrid_results
+
+  async def retrieve_by_sources(
+    self,
+    question: str,
+    sources: List[str],
+    config: SearchConfig,
+    query_embedding: Optional[QueryEmbedding] = None,
+  ) -> dict[str, List[dict]]:
+    """Search the union of the named `sources` in one round trip, then split
+    the hits by their `source` field. "global" is searched on its own,
+    concurrently: sharing the union search would either hide unrouted sources
+    from it, or, unfiltered, let a dominant source crowd the routed ones out
+    of the union's hits. Named sources a full union still left short are
+    searched again one by one, which costs an extra round trip only when one
+    of them dominates the others.
+
+    Args:
+      question: The query.
+      sources: Sources to search, "global" gets the top hits of any source.
+      config: `limit` is the number of candidates wanted per source, the
+        union search uses `limit * (number of named sources)`.
+      query_embedding: Precomputed embeddings of `question`.
+    Returns:
+      Map from every source in `sources` to its hits, in rank order.
+    """
+    named_sources = [source for source in sources if source != "global"]
+
+    def _config(limit: int, exprs: List[str]) -> SearchConfig:
+      if config.filter_expr:
+        exprs = exprs + [f"({config.filter_expr})"]
+      return SearchConfig(
+        sparse_weight=config.sparse_weight,
+        dense_weight=config.dense_weight,
+        limit=min(limit, SEARCH_LIMIT_MAX),
+        offset=config.offset,
+        filter_expr=" AND ".join(exprs) if exprs else None,
+        output_fields=config.output_fields,
+      )
+
+    searches = []
+    if named_sources:
+      source_expr = (
+        "source in [" + ", ".join(f'"{source}"' for source in named_sources) + "]"
+      )
+      union_config = _config(config.limit * len(named_sources), [source_expr])
+      searches.append(self.retrieve(question, union_config, query_embedding))
+    if "global" in sources:
+      global_config = _config(config.limit, [])
+      searches.append(self.retrieve(question, global_config, query_embedding))
+    found = await asyncio.gather(*searches)
+
+    results = {source: [] for source in sources}
+    if named_sources:
+      for hit in found[0]:
+        source = hit["entity"].get("source")
+        if source in results and len(results[source]) < config.limit:
+          results[source].append(hit)
+      # A full union may have been taken up by a dominant source, the sources
+      # it left short are searched again on their own
+      if len(found[0]) >= union_config.limit:
+        short = [s for s in named_sources if len(results[s]) < config.limit]
+        refills = await asyncio.gather(
+          *(
+            self.retrieve(
+              question,
+              _config(config.limit, [f'source == "{source}"']),
+              query_embedding,
+            )
+            for source in short
+          )
+        )
+        for source, hits in zip(short, refills):
+          results[source] = hits
+    if "global" in results:
+      # Copies, so reranking the buckets concurrently never shares a dict
+      results["global"] = [dict(hit) for hit in found[-1]]
+    return results
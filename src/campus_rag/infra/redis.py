@@ -1,8 +1,40 @@
 import redis
+import redis.asyncio as aioredis
 
 from campus_rag.constants.redis import REDIS_PORT
 from campus_rag.constants.redis import REDIS_PASSWD
+from campus_rag.constants.redis import REDIS_MAX_CONNECTIONS
+from campus_rag.constants.redis import REDIS_POOL_TIMEOUT
+from campus_rag.constants.redis import REDIS_STREAM_MAX_CONNECTIONS
+from campus_rag.constants.redis import REDIS_STREAM_POOL_TIMEOUT
 
 redis_client = redis.Redis(
   host="localhost", port=REDIS_PORT, password=REDIS_PASSWD, decode_responses=True
 )
+
+# For coroutines, so that a redis round trip never blocks the event loop.
+# Once every connection is in use, callers queue for up to REDIS_POOL_TIMEOUT
+# seconds instead of failing right away.
+async_redis_client = aioredis.Redis(
+  connection_pool=aioredis.BlockingConnectionPool(
+    host="localhost",
+    port=REDIS_PORT,
+    password=REDIS_PASSWD,
+    decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT,
+  )
+)
+
+# Only for blocking reads (XREAD with BLOCK), which hold a connection until
+# data comes or the block times out
+async_redis_stream_client = aioredis.Redis(
+  connection_pool=aioredis.BlockingConnectionPool(
+    host="localhost",
+    port=REDIS_PORT,
+    password=REDIS_PASSWD,
+    decode_responses=True,
+    max_connections=REDIS_STREAM_MAX_CONNECTIONS,
+    timeout=REDIS_STREAM_POOL_TIMEOUT,
+  )
+)
@@ -2,14 +2,18 @@
 This model wraps the reranking models and provides a common interface for them.
 The default reranker is BgeV2M3Reranker, which is a cross-encoder model.
 It's performance is better, tested in my another project.
+The model libraries are imported, and the default reranker loaded, only on
+first use, so importing this module stays cheap.
 """
 
 from abc import abstractmethod
+from collections import OrderedDict
 from typing import List
+import hashlib
+import threading
+import time
 
 import requests
-from FlagEmbedding import FlagReranker, LayerWiseFlagLLMReranker  # noqa
-from sentence_transformers import CrossEncoder
 from campus_rag.utils.chunk_ops import construct_embedding_key
 
 
@@ -36,17 +40,39 @@ class ModelReranker:
     """
     pass
 
+  def score(self, query: str, results: List[dict]) -> List[float]:
+    """
+    Compute the relevance score of every result, without sorting
+
+    Args:
+      query: Query string
+      results: Results of retrieval
+    Returns:
+      Scores, in the same order as results
+    """
+    self.rerank(query, results)
+    return [res["score"] for res in results]
+
 
 class BgeV2M3Reranker(ModelReranker):
   def __init__(self):
+    from FlagEmbedding import FlagReranker
+
     self.reranker_name = "BAAI/bge-reranker-v2-m3"
     self.reranker = FlagReranker(
       self.reranker_name, use_fp16=True, trust_remote_code=True
     )
 
-  def rerank(self, query: str, results: List[dict]) -> List[dict]:
+  def score(self, query: str, results: List[dict]) -> List[float]:
+    if not results:
+      return []
     inputs = [[query, construct_embedding_key(res["entity"])] for res in results]
     scores = self.reranker.compute_score(inputs)
+    # compute_score returns a bare float for a single pair
+    return scores if isinstance(scores, list) else [scores]
+
+  def rerank(self, query: str, results: List[dict]) -> List[dict]:
+    scores = self.score(query, results)
     for i in range(len(results)):
       results[i]["score"] = scores[i]
     results = sorted(results, key=lambda x: x["score"], reverse=True)
@@ -87,6 +113,8 @@ class JinaReranker(ModelReranker):
 
 class JinaRerankerLocal(ModelReranker):
   def __init__(self):
+    from sentence_transformers import CrossEncoder
+
     self.model = CrossEncoder(
       "jinaai/jina-reranker-v2-base-multilingual",
       automodel_args={"torch_dtype": "auto"},
@@ -96,13 +124,118 @@ class JinaRerankerLocal(ModelReranker):
   def get_name(self):
     return "jinaai/jina-reranker-v2-base-multilingual"
 
-  def rerank(self, query: str, results: List[str]) -> List[dict]:
+  def score(self, query: str, results: List[dict]) -> List[float]:
+    if not results:
+      return []
     inputs = [[query, construct_embedding_key(res["entity"])] for res in results]
-    scores = self.model.predict(inputs, convert_to_tensor=True).tolist()
+    return self.model.predict(inputs, convert_to_tensor=True).tolist()
+
+  def rerank(self, query: str, results: List[str]) -> List[dict]:
+    scores = self.score(query, results)
     for i in range(len(results)):
       results[i]["score"] = scores[i]
     results = sorted(results, key=lambda x: x["score"], reverse=True)
     return results
 
 
-reranker = BgeV2M3Reranker()
+class CachedReranker(ModelReranker):
+  """
+  Caches the scores of another reranker, keyed by (normalized query, chunk id,
+  content hash), so only the pairs never seen before go through the model.
+  Entries are evicted in LRU order once max_size is reached, and expire after
+  ttl seconds. Thread safe, since rerank is usually run in a threadpool.
+  """
+
+  def __init__(self, reranker: ModelReranker, max_size: int = 65536, ttl=60 * 60):
+    self.reranker = reranker
+    self.max_size = max_size
+    self.ttl = ttl
+    # key -> (score, expire time)
+    self._scores: OrderedDict[tuple, tuple[float, float]] = OrderedDict()
+    # chunk id -> keys of that chunk, used for invalidation
+    self._chunk_keys: dict[str, set[tuple]] = {}
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def _cache_key(query: str, result: dict) -> tuple:
+    normalized_query = " ".join(query.split()).lower()
+    content = construct_embedding_key(result["entity"])
+    content_hash = hashlib.sha1(content.encode()).hexdigest()
+    return normalized_query, result["id"], content_hash
+
+  def _pop(self, key: tuple):
+    self._scores.pop(key, None)
+    chunk_keys = self._chunk_keys.get(key[1])
+    if chunk_keys is not None:
+      chunk_keys.discard(key)
+      if not chunk_keys:
+        del self._chunk_keys[key[1]]
+
+  def score(self, query: str, results: List[dict]) -> List[float]:
+    keys = [self._cache_key(query, res) for res in results]
+    scores = [None] * len(results)
+    now = time.time()
+    with self._lock:
+      for i, key in enumerate(keys):
+        cached = self._scores.get(key)
+        if cached is None:
+          continue
+        if cached[1] < now:
+          self._pop(key)
+          continue
+        self._scores.move_to_end(key)
+        scores[i] = cached[0]
+    misses = [i for i, score in enumerate(scores) if score is None]
+    if misses:
+      miss_scores = self.reranker.score(query, [results[i] for i in misses])
+      expire_at = time.time() + self.ttl
+      with self._lock:
+        for i, score in zip(misses, miss_scores):
+          scores[i] = score
+          self._scores[keys[i]] = (score, expire_at)
+          self._scores.move_to_end(keys[i])
+          self._chunk_keys.setdefault(keys[i][1], set()).add(keys[i])
+        while len(self._scores) > self.max_size:
+          self._pop(next(iter(self._scores)))
+    return scores
+
+  def rerank(self, query: str, results: List[dict]) -> List[dict]:
+    scores = self.score(query, results)
+    for i in range(len(results)):
+      results[i]["score"] = scores[i]
+    results = sorted(results, key=lambda x: x["score"], reverse=True)
+    return results
+
+  def invalidate(self, chunk_id: str):
+    """Drop every cached score of a chunk, call it when the chunk changes."""
+    with self._lock:
+      for key in list(self._chunk_keys.get(chunk_id, ())):
+        self._pop(key)
+
+  def clear(self):
+    with self._lock:
+      self._scores.clear()
+      self._chunk_keys.clear()
+
+  def get_name(self):
+    return self.reranker.get_name()
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> CachedReranker:
+  """The default reranker, the model is loaded by the first call."""
+  global _reranker
+  with _reranker_lock:
+    if _reranker is None:
+      _reranker = CachedReranker(BgeV2M3Reranker())
+    return _reranker
+
+
+def __getattr__(name: str):
+  # `from campus_rag.infra.reranker import reranker` loads the default reranker
+  if name == "reranker":
+    return get_reranker()
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,119 @@
+"""
+Semantic cache: stores values next to the dense embedding of the query that
+produced them, and answers from the nearest cached query whose similarity is
+above a threshold. Unlike the redis LLM cache, differently worded versions of
+the same question share one entry.
+The caches live in process, every worker has its own. They are invalidated
+across workers through a version number in redis, see `sync_semantic_caches`.
+"""
+
+import logging
+import time
+from typing import Any, Optional
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from redis.exceptions import RedisError
+
+from campus_rag.constants.redis import SEMANTIC_CACHE_VERSION_KEY
+from campus_rag.infra.redis import async_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+  def __init__(self, name: str, threshold=0.95, max_size=4096, ttl=60 * 60 * 24):
+    """
+    Args:
+      name: Name of the cache, used in logs.
+      threshold: Minimal cosine similarity for a hit.
+      max_size: Max number of entries, the oldest ones are evicted first.
+      ttl: Seconds an entry stays valid.
+    """
+    self.name = name
+    self.threshold = threshold
+    self.max_size = max_size
+    self.ttl = ttl
+    self.clear()
+
+  def lookup(self, embedding: np.ndarray) -> Optional[Any]:
+    """Returns the value of the most similar query, None if there is no hit.
+    Args:
+      embedding: Normalized dense embedding of the query.
+    """
+    if self._size == 0:
+      return None
+    similarities = self._embeddings[: self._size] @ embedding
+    similarities[self._expire_at[: self._size] < time.time()] = -np.inf
+    best = int(np.argmax(similarities))
+    if similarities[best] < self.threshold:
+      return None
+    logger.info(f"Semantic cache hit ({self.name}): {similarities[best]:.3f}")
+    return self._values[best]
+
+  def store(self, embedding: np.ndarray, value: Any):
+    """Stores a value, overwriting the oldest entry once the cache is full."""
+    if self._embeddings is None:
+      self._embeddings = np.zeros((self.max_size, len(embedding)), dtype=np.float32)
+    self._embeddings[self._next] = embedding
+    self._values[self._next] = value
+    self._expire_at[self._next] = time.time() + self.ttl
+    self._next = (self._next + 1) % self.max_size
+    self._size = min(self._size + 1, self.max_size)
+
+  def clear(self):
+    # Ring buffer of entries, allocated on the first store
+    self._embeddings: Optional[np.ndarray] = None
+    self._values: list[Any] = [None] * self.max_size
+    self._expire_at = np.zeros(self.max_size)
+    self._next = 0
+    self._size = 0
+
+
+async def embed_query(query: str) -> np.ndarray:
+  """Normalized dense embedding of a query, used as the semantic cache key."""
+  from campus_rag.infra.embedding import embedding_model
+
+  return await run_in_threadpool(
+    embedding_model.encode, query, normalize_embeddings=True
+  )
+
+
+# Raw query -> (enhanced query, routed sources, embeddings of the enhanced query)
+enhance_route_cache = SemanticCache("enhance_route")
+# Raw query -> (context text, answer chunks), only used without history
+answer_cache = SemanticCache("answer")
+# Cache version the entries of this worker belong to
+_version: Optional[str] = None
+
+
+def _clear_semantic_caches():
+  enhance_route_cache.clear()
+  answer_cache.clear()
+
+
+async def sync_semantic_caches() -> bool:
+  """Drops the entries of this worker if the caches were invalidated, by any
+  worker, since the last call. Call it before using the caches.
+  Returns:
+    False if the version could not be read, the caches must not be used then.
+  """
+  global _version
+  try:
+    version = await async_redis_client.get(SEMANTIC_CACHE_VERSION_KEY)
+  except RedisError as e:
+    logger.warning(f"Semantic cache version unavailable, skip the cache: {e}")
+    return False
+  if version != _version:
+    _clear_semantic_caches()
+    _version = version
+  return True
+
+
+async def invalidate_semantic_caches():
+  """Drop every entry of every worker, call it when the knowledge base changes."""
+  _clear_semantic_caches()
+  try:
+    await async_redis_client.incr(SEMANTIC_CACHE_VERSION_KEY)
+  except RedisError as e:
+    logger.error(f"Failed to invalidate the semantic caches of other workers: {e}")
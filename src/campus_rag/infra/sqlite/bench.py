@@ -0,0 +1,121 @@
+"""
+Concurrent append and read throughput of the conversation db layer, for each
+SQLite engine profile. Every profile runs on its own temporary database.
+
+  python -m campus_rag.infra.sqlite.bench --profiles default --profiles wal
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import typer
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel import SQLModel
+
+from campus_rag.constants.conversation import HISTORY_WINDOW_SIZE
+from campus_rag.constants.sqlite import SQLITE_PROFILES
+from campus_rag.utils.logging_config import setup_logger
+from . import conversation as db
+from .init import apply_pragmas, create_sqlite_async_engine
+
+logger = setup_logger(need_config=__name__ == "__main__")
+
+app = typer.Typer()
+
+_USER_ID = 1
+
+
+def _percentile(values: list[float], q: float) -> float:
+  values = sorted(values)
+  return values[min(int(len(values) * q), len(values) - 1)]
+
+
+async def _bench_profile(
+  profile: str, conversations: int, messages: int, readers: int, reads: int
+) -> dict:
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    db_file = os.path.join(tmp_dir, "bench.db")
+    sync_engine = create_engine(f"sqlite:///{db_file}")
+    apply_pragmas(sync_engine, SQLITE_PROFILES[profile]["pragmas"])
+    SQLModel.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+    engine = create_sqlite_async_engine(f"sqlite+aiosqlite:///{db_file}", profile)
+    db.async_session = async_sessionmaker(engine, expire_on_commit=False)
+
+    conversation_ids = [
+      (await db.insert_conversation(_USER_ID)).conversation_id
+      for _ in range(conversations)
+    ]
+    append_latencies = []
+    read_latencies = []
+
+    async def writer(conversation_id: str):
+      for i in range(messages):
+        start = time.perf_counter()
+        await db.append_message(_USER_ID, conversation_id, f"message {i} " * 20, "user")
+        append_latencies.append(time.perf_counter() - start)
+
+    async def reader():
+      for _ in range(reads):
+        start = time.perf_counter()
+        await db.find_recent_messages(
+          random.choice(conversation_ids), HISTORY_WINDOW_SIZE
+        )
+        await db.find_conversations_by_user(_USER_ID, limit=10)
+        read_latencies.append(time.perf_counter() - start)
+
+    async def timed(coroutines) -> float:
+      start = time.perf_counter()
+      await asyncio.gather(*coroutines)
+      return time.perf_counter() - start
+
+    write_time, read_time = await asyncio.gather(
+      timed(writer(conversation_id) for conversation_id in conversation_ids),
+      timed(reader() for _ in range(readers)),
+    )
+    await engine.dispose()
+  return {
+    "appends/s": len(append_latencies) / write_time,
+    "append p50 ms": _percentile(append_latencies, 0.5) * 1000,
+    "append p99 ms": _percentile(append_latencies, 0.99) * 1000,
+    "reads/s": len(read_latencies) / read_time,
+    "read p50 ms": _percentile(read_latencies, 0.5) * 1000,
+    "read p99 ms": _percentile(read_latencies, 0.99) * 1000,
+  }
+
+
+@app.command()
+def run(
+  profiles: list[str] = typer.Option(["default", "wal"]),
+  conversations: int = 32,
+  messages: int = 50,
+  readers: int = 32,
+  reads: int = 50,
+):
+  """Appends `messages` messages to each of `conversations` conversations
+  while `readers` clients load `reads` history windows each."""
+  asyncio.run(_bench_profiles(profiles, conversations, messages, readers, reads))
+
+
+async def _bench_profiles(
+  profiles: list[str], conversations: int, messages: int, readers: int, reads: int
+):
+  # One event loop for every profile, the db write lock is bound to it
+  original_session = db.async_session
+  try:
+    for profile in profiles:
+      result = await _bench_profile(profile, conversations, messages, readers, reads)
+      logger.info(
+        f"{profile}: "
+        + ", ".join(f"{name} {value:.1f}" for name, value in result.items())
+      )
+  finally:
+    db.async_session = original_session
+
+
+if __name__ == "__main__":
+  app()
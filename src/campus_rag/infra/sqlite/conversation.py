@@ -1,4 +1,5 @@
 from sqlmodel import select
+from sqlalchemy import func, tuple_, update
 from sqlalchemy.orm import selectinload
 from campus_rag.domain.rag.po import (
   Conversation,
@@ -7,14 +8,30 @@ from campus_rag.domain.rag.po import (
   sorted_columns,
 )
 from campus_rag.domain.user.po import User
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 from .init import async_session
+import asyncio
 import logging
 import time
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# SQLite has a single write lock and its busy handler retries it without any
+# fairness, so under load some writers wait past busy_timeout and fail with
+# "database is locked". Writers of this process queue here in order instead.
+_write_lock = asyncio.Lock()
+
+
+@asynccontextmanager
+async def write_session() -> AsyncGenerator[AsyncSession, None]:
+  """Session for a write transaction, one at a time in this process."""
+  async with _write_lock:
+    async with async_session() as session:
+      yield session
+
 
 async def find_user_by_name(username: str) -> Optional[User]:
   """Finds a user by user_id from the database."""
@@ -26,7 +43,7 @@ async def find_user_by_name(username: str) -> Optional[User]:
 
 async def insert_user(user: User) -> None:
   """Inserts a new user into the database."""
-  async with async_session() as session:
+  async with write_session() as session:
     session.add(user)
     await session.commit()
     await session.refresh(user)
@@ -34,7 +51,7 @@ async def insert_user(user: User) -> None:
 
 async def insert_conversation(user_id: str) -> Conversation:
   """Inserts a new conversation into the database."""
-  async with async_session() as session:
+  async with write_session() as session:
     new_conversation = Conversation(
       user_id=user_id,
       update_time=time.time(),
@@ -47,16 +64,20 @@ async def insert_conversation(user_id: str) -> Conversation:
 
 
 async def find_conversation_by_id(
-  user_id: str, conversation_id: uuid.UUID
+  user_id: str, conversation_id: uuid.UUID, with_messages: bool = True
 ) -> Optional[Conversation]:
-  """Finds a specific conversation by ID and user_id."""
+  """Finds a specific conversation by ID and user_id.
+  Args:
+    with_messages: Also load all its messages.
+  """
   async with async_session() as session:
     statement = (
       select(Conversation)
       .where(Conversation.conversation_id == conversation_id)
       .where(Conversation.user_id == user_id)
-      .options(selectinload(Conversation.messages))
     )
+    if with_messages:
+      statement = statement.options(selectinload(Conversation.messages))
     result = await session.execute(statement)
     return result.scalars().first()
 
@@ -66,8 +87,14 @@ async def find_conversations_by_user(
   offset: int = 0,
   limit: int = 10,
   sorted_by: SortedBy = SortedBy.updated_reverse,
+  after: Optional[tuple[float, str]] = None,
 ) -> list[Conversation]:
-  """Finds conversations for a user with sorting and pagination."""
+  """Finds conversations for a user with sorting and pagination.
+  Args:
+    after: (sort column value, conversation id) of the last conversation of
+      the previous page, the page starts right after it instead of at
+      `offset`. Served by the (user_id, <sort column>, conversation_id) index.
+  """
   async with async_session() as session:
     statement = select(Conversation).where(Conversation.user_id == user_id)
 
@@ -79,35 +106,124 @@ async def find_conversations_by_user(
     if sort_column is None:
       raise ValueError("Invalid sort key")
 
+    # conversation_id breaks ties, so every conversation has one position
+    sort_key = tuple_(sort_column, Conversation.conversation_id)
     if descending:
-      statement = statement.order_by(sort_column.desc())
+      statement = statement.order_by(
+        sort_column.desc(), Conversation.conversation_id.desc()
+      )
+      if after is not None:
+        statement = statement.where(sort_key < tuple_(*after))
     else:
-      statement = statement.order_by(sort_column.asc())
+      statement = statement.order_by(
+        sort_column.asc(), Conversation.conversation_id.asc()
+      )
+      if after is not None:
+        statement = statement.where(sort_key > tuple_(*after))
 
-    statement = statement.offset(offset).limit(limit)
+    if after is None:
+      statement = statement.offset(offset)
+    statement = statement.limit(limit)
     result = await session.execute(statement)
     return result.scalars().all()
 
 
 async def find_messages_by_conversation(
   conversation_id: uuid.UUID,
+  after_id: Optional[str] = None,
+  limit: Optional[int] = None,
 ) -> list[ChatMessage]:
-  """Finds all messages for a conversation."""
+  """Finds the messages for a conversation, oldest first.
+  Args:
+    after_id: Only the messages after the one with this id.
+    limit: Max number of messages, all of them if None.
+  """
   async with async_session() as session:
     statement = (
       select(ChatMessage)
       .where(ChatMessage.conversation_id == conversation_id)
-      .order_by(ChatMessage.create_time)
+      .order_by(ChatMessage.create_time, ChatMessage.message_id)
     )
+    if after_id is not None:
+      after_time = await session.scalar(
+        select(ChatMessage.create_time).where(ChatMessage.message_id == after_id)
+      )
+      if after_time is None:
+        return []
+      statement = statement.where(
+        tuple_(ChatMessage.create_time, ChatMessage.message_id)
+        > tuple_(after_time, after_id)
+      )
+    if limit is not None:
+      statement = statement.limit(limit)
     result = await session.execute(statement)
     return result.scalars().all()
 
 
-async def insert_message(
-  conversation_id: uuid.UUID, content: str, role: str, metainfo: Optional[str] = None
-) -> ChatMessage:
-  """Inserts a new message into the database."""
+async def find_recent_messages(
+  conversation_id: uuid.UUID, limit: int
+) -> list[ChatMessage]:
+  """Finds the `limit` most recent messages of a conversation, oldest first."""
   async with async_session() as session:
+    statement = (
+      select(ChatMessage)
+      .where(ChatMessage.conversation_id == conversation_id)
+      # Same order as find_messages_by_conversation, reversed
+      .order_by(ChatMessage.create_time.desc(), ChatMessage.message_id.desc())
+      .limit(limit)
+    )
+    result = await session.execute(statement)
+    return result.scalars().all()[::-1]
+
+
+async def append_message(
+  user_id: int,
+  conversation_id: uuid.UUID,
+  content: str,
+  role: str,
+  metainfo: Optional[str] = None,
+  default_title: Optional[str] = None,
+) -> Optional[tuple[ChatMessage, bool]]:
+  """
+  Appends a message to a conversation of the user and bumps its update_time,
+  in a single transaction and without loading the other messages.
+  Args:
+    default_title: Title set along with the first user message of a
+      conversation without title.
+  Returns:
+    (the new message, whether it is the first user message of a conversation
+    without title), None if the user has no such conversation.
+  """
+  async with write_session() as session:
+    result = await session.execute(
+      update(Conversation)
+      .where(Conversation.conversation_id == conversation_id)
+      .where(Conversation.user_id == user_id)
+      .values(update_time=time.time())
+    )
+    if result.rowcount == 0:
+      return None
+    needs_title = False
+    if role == "user":
+      title = await session.scalar(
+        select(Conversation.title).where(
+          Conversation.conversation_id == conversation_id
+        )
+      )
+      if title is None:
+        user_messages = await session.scalar(
+          select(func.count())
+          .select_from(ChatMessage)
+          .where(ChatMessage.conversation_id == conversation_id)
+          .where(ChatMessage.role == "user")
+        )
+        needs_title = user_messages == 0
+    if needs_title and default_title is not None:
+      await session.execute(
+        update(Conversation)
+        .where(Conversation.conversation_id == conversation_id)
+        .values(title=default_title)
+      )
     new_message = ChatMessage(
       conversation_id=conversation_id,
       role=role,
@@ -116,38 +232,22 @@ async def insert_message(
     )
     session.add(new_message)
     await session.commit()
-    await session.refresh(new_message)
-    conversation = (
-      (
-        await session.execute(
-          select(Conversation)
-          .where(Conversation.conversation_id == conversation_id)
-          .options(selectinload(Conversation.messages))
-        )
-      )
-      .scalars()
-      .first()
-    )
-    await session.refresh(conversation, attribute_names=["messages"])
-    return new_message
-
-
-async def update_conversation_time(conversation_id: uuid.UUID) -> None:
-  """Updates the update_time of a conversation."""
-  async with async_session() as session:
-    statement = select(Conversation).where(
-      Conversation.conversation_id == conversation_id
-    )
-    result = await session.execute(statement)
-    conversation = result.scalars().first()
-    if conversation:
-      conversation.update_time = time.time()
-      session.add(conversation)
-      await session.commit()
+    return new_message, needs_title
 
 
 async def update_conversation(conversation: Conversation) -> None:
   """Updates the conversation in the database."""
-  async with async_session() as session:
+  async with write_session() as session:
     session.add(conversation)
     await session.commit()
+
+
+async def update_conversation_title(conversation_id: uuid.UUID, title: str) -> None:
+  """Sets the title of a conversation."""
+  async with write_session() as session:
+    await session.execute(
+      update(Conversation)
+      .where(Conversation.conversation_id == conversation_id)
+      .values(title=title)
+    )
+    await session.commit()
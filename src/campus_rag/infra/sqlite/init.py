@@ -3,11 +3,14 @@ from campus_rag.constants.sqlite import (
   SQLITE_ASYNC_URL,
   SQLITE_SYNC_URL,
   SQLITE_FILE_NAME,
+  SQLITE_PROFILE,
+  SQLITE_PROFILES,
 )
 from . import conversation as db
 from campus_rag.utils.logging_config import setup_logger
 from campus_rag.utils.passwd import get_password_hash
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import Engine, event
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 import campus_rag.domain.user.po as user  # noqa 这里需要导入PO模块以确保SQLModel能够正确识别和创建表结构
 import campus_rag.domain.rag.po  # noqa 这里需要导入PO模块以确保SQLModel能够正确识别和创建表结构
 import asyncio
@@ -18,8 +21,40 @@ log_need_config = __name__ == "__main__"
 logger = setup_logger(need_config=log_need_config)
 
 
-async_engine = create_async_engine(SQLITE_ASYNC_URL, echo=False)
+def apply_pragmas(engine: Engine, pragmas: dict):
+  """Runs `PRAGMA name=value` on every new connection of the engine."""
+  if not pragmas:
+    return
+
+  @event.listens_for(engine, "connect")
+  def _set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+      cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def create_sqlite_async_engine(
+  url: str = SQLITE_ASYNC_URL, profile: str = SQLITE_PROFILE
+) -> AsyncEngine:
+  """
+  Args:
+    profile: Name of the pool and pragma settings in SQLITE_PROFILES.
+  """
+  settings = SQLITE_PROFILES[profile]
+  engine = create_async_engine(
+    url,
+    echo=False,
+    pool_size=settings["pool_size"],
+    max_overflow=settings["max_overflow"],
+  )
+  apply_pragmas(engine.sync_engine, settings["pragmas"])
+  return engine
+
+
+async_engine = create_sqlite_async_engine()
 sync_engine = create_engine(SQLITE_SYNC_URL, echo=False)
+apply_pragmas(sync_engine, SQLITE_PROFILES[SQLITE_PROFILE]["pragmas"])
 async_session = async_sessionmaker(async_engine, expire_on_commit=False)
 
 
@@ -34,6 +69,16 @@ def create_db_and_tables():
   logger.info(f"Database and tables created at {SQLITE_FILE_NAME}")
 
 
+@app.command()
+def migrate():
+  """Creates the tables and indexes missing from an existing database."""
+  SQLModel.metadata.create_all(sync_engine)
+  for table in SQLModel.metadata.sorted_tables:
+    for index in table.indexes:
+      index.create(sync_engine, checkfirst=True)
+  logger.info(f"Database at {SQLITE_FILE_NAME} migrated")
+
+
 @app.command()
 def add_admin(username: str, password: str) -> bool:
   """Creates an admin user in the database."""
@@ -4,6 +4,7 @@ from campus_rag.constants.log import LOG_FILE_PATH
 
 logger = setup_logger(log2file=True)
 from campus_rag.api.routes import rag, course_scheduler, user, knowledge_base
+from campus_rag.utils.llm import llm_gateway
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
@@ -47,6 +48,12 @@ async def schedule_error_handler(request: Request, exc: ScheduleError):
   )
 
 
+@app.get("/llm/metrics")
+async def get_llm_metrics() -> dict:
+  """Queue depth and in-flight calls of this worker's LLM gateway."""
+  return llm_gateway.metrics()
+
+
 @app.get("/log")
 async def stream_logs():
   async def log_generator():
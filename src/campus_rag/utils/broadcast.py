@@ -0,0 +1,104 @@
+import asyncio
+from typing import Any, AsyncGenerator, Optional
+
+
+class ReplayBuffer:
+  """
+  Append-only buffer written by one producer, that any number of subscribers
+  read from any offset, each at its own pace. Subscribers joining late get
+  the items appended so far first, then wait for new ones.
+  The producer can wait for slow subscribers with `wait_for_readers`, a
+  subscriber it waited for in vain is not waited for again until it caught up.
+  Not thread safe, use it from a single event loop.
+  """
+
+  def __init__(self):
+    self.items: list[Any] = []
+    self.closed = False
+    self.error: Optional[BaseException] = None
+    self._appended = asyncio.Event()
+    # Subscription -> offset of the next item it reads
+    self._offsets: dict[int, int] = {}
+    # Subscriptions too slow to wait for, left out of `lag`
+    self._slow: set[int] = set()
+    self._next_subscription = 0
+    self._consumed = asyncio.Event()
+
+  @property
+  def subscribers(self) -> int:
+    return len(self._offsets)
+
+  def lag(self) -> int:
+    """Number of items the slowest subscriber, that is not marked slow, has
+    not read yet."""
+    offsets = [
+      offset
+      for subscription, offset in self._offsets.items()
+      if subscription not in self._slow
+    ]
+    if not offsets:
+      return 0
+    return len(self.items) - min(offsets)
+
+  def _notify(self):
+    # Wake up every waiting subscriber, later waits use a fresh event
+    self._appended.set()
+    self._appended = asyncio.Event()
+
+  def append(self, item: Any):
+    if self.closed:
+      raise RuntimeError("Append to a closed buffer")
+    self.items.append(item)
+    self._notify()
+
+  def close(self, error: Optional[BaseException] = None):
+    """Mark the end of the items, subscribers raise `error` if given."""
+    if self.closed:
+      return
+    self.closed = True
+    self.error = error
+    self._notify()
+
+  async def wait_for_readers(self, max_lag: int, timeout: float) -> bool:
+    """Waits until every subscriber is at most `max_lag` items behind.
+    Returns:
+      False if it timed out, the producer then goes on regardless, and the
+      subscribers still lagging behind are marked slow: later calls do not
+      wait for them, until they read every item appended so far.
+    """
+    deadline = asyncio.get_running_loop().time() + timeout
+    while self.lag() > max_lag:
+      self._consumed.clear()
+      remaining = deadline - asyncio.get_running_loop().time()
+      try:
+        await asyncio.wait_for(self._consumed.wait(), max(remaining, 0))
+      except asyncio.TimeoutError:
+        for subscription, offset in self._offsets.items():
+          if len(self.items) - offset > max_lag:
+            self._slow.add(subscription)
+        return False
+    return True
+
+  async def subscribe(self, offset: int = 0) -> AsyncGenerator:
+    """Yields the items from `offset` on, until the buffer is closed."""
+    subscription = self._next_subscription
+    self._next_subscription += 1
+    self._offsets[subscription] = offset
+    try:
+      while True:
+        while offset < len(self.items):
+          yield self.items[offset]
+          offset += 1
+          self._offsets[subscription] = offset
+          self._consumed.set()
+        # Caught up, waited for again
+        self._slow.discard(subscription)
+        if self.closed:
+          if self.error is not None:
+            raise self.error
+          return
+        await self._appended.wait()
+    finally:
+      del self._offsets[subscription]
+      self._slow.discard(subscription)
+      self._consumed.set()
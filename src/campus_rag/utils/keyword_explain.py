@@ -1,18 +1,129 @@
 import json
+import os
+import threading
+from collections import deque
+from typing import Optional
 
+_NOT_FOUND = "No keyword explanations found."
 
-def get_keyword_explain(path: str) -> str:
+
+class _KeywordMatcher:
+  """
+  Aho-Corasick automaton over a list of keywords, finds every keyword that
+  occurs in a text in a single pass over the text.
+  """
+
+  def __init__(self, keywords: list[str]):
+    self.goto: list[dict[str, int]] = [{}]
+    self.fail: list[int] = [0]
+    # state -> indices of the keywords that end at this state
+    self.output: list[set[int]] = [set()]
+    for idx, keyword in enumerate(keywords):
+      if not keyword:
+        continue
+      state = 0
+      for ch in keyword:
+        if ch not in self.goto[state]:
+          self.goto.append({})
+          self.fail.append(0)
+          self.output.append(set())
+          self.goto[state][ch] = len(self.goto) - 1
+        state = self.goto[state][ch]
+      self.output[state].add(idx)
+    # Breadth first, so the fail state of a node is always built before it
+    queue = deque(self.goto[0].values())
+    while queue:
+      state = queue.popleft()
+      for ch, next_state in self.goto[state].items():
+        queue.append(next_state)
+        fail = self.fail[state]
+        while fail and ch not in self.goto[fail]:
+          fail = self.fail[fail]
+        self.fail[next_state] = self.goto[fail].get(ch, 0)
+        self.output[next_state] |= self.output[self.fail[next_state]]
+
+  def find(self, text: str) -> set[int]:
+    """Returns the indices of the keywords occurring in text."""
+    found = set()
+    state = 0
+    for ch in text:
+      while state and ch not in self.goto[state]:
+        state = self.fail[state]
+      state = self.goto[state].get(ch, 0)
+      found |= self.output[state]
+    return found
+
+
+class KeywordGlossary:
+  """
+  Keyword explanations of a json file, loaded once and reloaded whenever the
+  file's mtime changes.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self._mtime = None
+    self._items: list[dict] = []
+    self._matcher = _KeywordMatcher([])
+    self._lock = threading.Lock()
+
+  def _refresh(self):
+    mtime = os.stat(self.path).st_mtime
+    if mtime == self._mtime:
+      return
+    with self._lock:
+      if mtime == self._mtime:
+        return
+      with open(self.path) as f:
+        data = json.load(f)
+      items = [item for item in data if "keyword" in item and "explanation" in item]
+      self._matcher = _KeywordMatcher([item["keyword"].lower() for item in items])
+      self._items = items
+      self._mtime = mtime
+
+  def match(self, text: str) -> list[dict]:
+    """Returns the entries whose keyword occurs in text, in file order."""
+    self._refresh()
+    found = self._matcher.find(text.lower())
+    return [item for idx, item in enumerate(self._items) if idx in found]
+
+  def explain(self, query: Optional[str] = None) -> str:
+    """
+    Args:
+        query (str): Only explain the keywords occurring in it, all keywords
+          are explained if it is None.
+    Returns:
+        str: One "keyword: explanation" per line.
+    """
+    if query is None:
+      self._refresh()
+      items = self._items
+    else:
+      items = self.match(query)
+    explain_str = "\n".join(
+      f"{item['keyword']}: {item['explanation']}" for item in items
+    )
+    return explain_str if explain_str else _NOT_FOUND
+
+
+_glossaries: dict[str, KeywordGlossary] = {}
+
+
+def get_glossary(path: str) -> KeywordGlossary:
+  """Returns the shared glossary of the given path."""
+  path = os.path.abspath(path)
+  if path not in _glossaries:
+    _glossaries.setdefault(path, KeywordGlossary(path))
+  return _glossaries[path]
+
+
+def get_keyword_explain(path: str, query: Optional[str] = None) -> str:
   """
   Get the keyword explain for the given path.
   Args:
       path (str): The path to the file or directory.
+      query (str): If given, only the keywords occurring in it are explained.
   Returns:
       str: The keyword explain.
   """
-  with open(path) as f:
-    data = json.load(f)
-  explain_str = ""
-  for item in data:
-    if "keyword" in item and "explanation" in item:
-      explain_str += f"{item['keyword']}: {item['explanation']}\n"
-  return explain_str.strip() if explain_str else "No keyword explanations found."
+  return get_glossary(path).explain(query)
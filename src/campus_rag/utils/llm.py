@@ -2,6 +2,7 @@
 Wrapper for OpenAI API
 """
 
+import asyncio
 import hashlib
 import json
 import os
@@ -10,24 +11,52 @@ import re
 from openai import OpenAI, AsyncOpenAI
 from langchain_openai import ChatOpenAI
 from pydantic import BaseModel
-from typing import TypedDict, AsyncGenerator
+from redis.exceptions import RedisError
+from typing import Optional, TypedDict, AsyncGenerator
 from campus_rag.domain.course.po import ScheduleError
-from campus_rag.infra.redis import redis_client
+from campus_rag.infra.redis import redis_client, async_redis_client
+from campus_rag.utils.broadcast import ReplayBuffer
+from campus_rag.utils.llm_gateway import LLMGateway
+from campus_rag.constants.llm import (
+  LLM_CONNECT_TIMEOUT,
+  LLM_MAX_CONCURRENCY,
+  LLM_MAX_CONNECTIONS,
+  LLM_MAX_RETRIES,
+  LLM_RATE_PER_SECOND,
+  LLM_TIMEOUT,
+)
 
 _ALI_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 
 
 logger = logging.getLogger(__name__)
 _llm_name = "qwen-max-2025-01-25"
+# Seconds between chunks when replaying a cached stream
+_STREAM_REPLAY_INTERVAL = 0.02
 _llm_key = os.getenv("LCX_QWEN_API_KEY")
 _llm_bare = OpenAI(base_url=_ALI_URL, api_key=_llm_key)
 
-_llm_bare_async = AsyncOpenAI(base_url=_ALI_URL, api_key=_llm_key)
+llm_gateway = LLMGateway(
+  max_concurrency=LLM_MAX_CONCURRENCY,
+  rate_per_second=LLM_RATE_PER_SECOND,
+  timeout=LLM_TIMEOUT,
+  connect_timeout=LLM_CONNECT_TIMEOUT,
+  max_connections=LLM_MAX_CONNECTIONS,
+)
+# Retries are done by the helpers below, with backoff and through the gateway
+_llm_bare_async = AsyncOpenAI(
+  base_url=_ALI_URL,
+  api_key=_llm_key,
+  http_client=llm_gateway.http_client,
+  max_retries=0,
+)
 
 _llm_langchain = ChatOpenAI(
   model=_llm_name,
   base_url=_ALI_URL,
   api_key=_llm_key,
+  http_async_client=llm_gateway.http_client,
+  max_retries=0,
 )
 
 
@@ -39,6 +68,13 @@ class Message(TypedDict):
 Prompts = list[Message]
 
 
+# Calls and streams in flight, by cache key
+_inflight_calls: dict[str, asyncio.Task] = {}
+_inflight_streams: dict[str, tuple[ReplayBuffer, asyncio.Task]] = {}
+# Structured output runnables, by output model
+_structured_runnables: dict[type[BaseModel], object] = {}
+
+
 def get_cache_key(prompt: Prompts) -> str:
   serialized_prompt = json.dumps(prompt, ensure_ascii=False, sort_keys=True)
   return f"llm_cache:{hashlib.sha256(serialized_prompt.encode()).hexdigest()}"
@@ -70,103 +106,243 @@ def llm_chat(prompts: Prompts) -> str:
       return res
     except Exception as e:
       logging.error(f"Errors occurred: {e}")
-      retries -= 1
-      if retries == 0:
+      tries += 1
+      if tries == retries:
         raise RuntimeError(
           f"Failed to get response from Qwen API after {retries} retries"
         )
 
 
-async def llm_chat_async(prompts: Prompts) -> str:
+async def _cache_get(cache_key: str) -> Optional[str]:
+  """Reads the LLM cache, an unavailable redis is a miss."""
+  try:
+    return await async_redis_client.get(cache_key)
+  except RedisError as e:
+    logging.warning(f"LLM cache read failed: {e}")
+    return None
+
+
+async def _cache_set(cache_key: str, value: str):
+  """Writes the LLM cache for 1 day, skipped if redis is unavailable."""
+  try:
+    await async_redis_client.set(cache_key, value, ex=60 * 60 * 24)
+  except RedisError as e:
+    logging.warning(f"LLM cache write failed: {e}")
+
+
+def _backoff(tries: int) -> float:
+  """Seconds to wait before retry number `tries`."""
+  return 0.5 * 2**tries
+
+
+async def llm_chat_async(prompts: Prompts, timeout: Optional[float] = None) -> str:
+  """
+  Args:
+    prompts: The prompts.
+    timeout: Timeout of the call in seconds, the gateway default if None.
+  """
   cache_key = get_cache_key(prompts)
-  cached_response = redis_client.get(cache_key)
+  cached_response = await _cache_get(cache_key)
 
   if cached_response:
     logging.info("LLM cache hit (async)")
     return cached_response
-  else:
+
+  # Single flight: identical prompts in flight share one call, which runs in
+  # its own task so that a cancelled caller does not fail the others
+  call = _inflight_calls.get(cache_key)
+  if call is None:
     logging.debug("Calling remote llm")
+    call = asyncio.create_task(_llm_chat_remote(prompts, cache_key, timeout))
+    _inflight_calls[cache_key] = call
+    call.add_done_callback(lambda _: _inflight_calls.pop(cache_key, None))
+  else:
+    logging.info("Joining in-flight LLM call")
+  return await asyncio.shield(call)
 
-  retries = 3
+
+async def _llm_chat_remote(
+  prompts: Prompts, cache_key: str, timeout: Optional[float]
+) -> str:
+  retries = LLM_MAX_RETRIES
   tries = 0
   while tries < retries:
     try:
-      res = (
-        (
-          await _llm_bare_async.chat.completions.create(
-            model=_llm_name,
-            messages=prompts,
+      async with llm_gateway.slot():
+        res = (
+          (
+            await _llm_bare_async.chat.completions.create(
+              model=_llm_name,
+              messages=prompts,
+              timeout=timeout or llm_gateway.timeout,
+            )
           )
+          .choices[0]
+          .message.content.strip()
         )
-        .choices[0]
-        .message.content.strip()
-      )
-      redis_client.set(cache_key, res, ex=60 * 60 * 24)  # cache for 1 day
+      await _cache_set(cache_key, res)
       return res
     except Exception as e:
       logging.error(f"Errors occurred: {e}")
-      retries -= 1
-      if retries == 0:
+      tries += 1
+      if tries == retries:
         raise RuntimeError(
           f"Failed to get response from Qwen API after {retries} retries"
         )
+      await asyncio.sleep(_backoff(tries))
 
 
-async def llm_chat_astream(prompts: Prompts) -> AsyncGenerator:
-  cache_key = get_cache_key(prompts)
-  cached_response = redis_client.get(cache_key)
+def get_stream_cache_key(prompt: Prompts) -> str:
+  """Streamed answers are cached as their chunk sequence, under their own keys."""
+  return get_cache_key(prompt).replace("llm_cache:", "llm_stream_cache:", 1)
+
+
+async def llm_chat_astream(
+  prompts: Prompts,
+  replay_interval: float = _STREAM_REPLAY_INTERVAL,
+  timeout: Optional[float] = None,
+) -> AsyncGenerator:
+  """Stream the answer of the LLM, chunk by chunk.
+  Args:
+    prompts: The prompts.
+    replay_interval: Seconds to wait between chunks when replaying a cached
+      answer, so cached answers are streamed like fresh ones.
+    timeout: Timeout of waiting for the stream or its next chunk in seconds,
+      the gateway default if None.
+  """
+  cache_key = get_stream_cache_key(prompts)
+  cached_response = await _cache_get(cache_key)
 
   if cached_response:
     logging.info("LLM cache hit (stream)")
-    yield cached_response
+    for content in json.loads(cached_response):
+      yield content
+      await asyncio.sleep(replay_interval)
     return
-  else:
+
+  # Single flight: identical prompts in flight share one stream, every
+  # subscriber gets all of its chunks from the start
+  flight = _inflight_streams.get(cache_key)
+  if flight is None:
     logging.debug("Calling remote llm")
+    buffer = ReplayBuffer()
+    task = asyncio.create_task(_fill_stream(buffer, prompts, cache_key, timeout))
+    flight = _inflight_streams[cache_key] = (buffer, task)
+  else:
+    logging.info("Joining in-flight LLM stream")
+  buffer, task = flight
+  subscription = buffer.subscribe()
+  try:
+    async for content in subscription:
+      yield content
+  finally:
+    await subscription.aclose()
+    if buffer.subscribers == 0 and not buffer.closed:
+      # Nobody is reading anymore, stop paying for the stream
+      _inflight_streams.pop(cache_key, None)
+      task.cancel()
 
-  retries = 3
+
+async def _fill_stream(
+  buffer: ReplayBuffer, prompts: Prompts, cache_key: str, timeout: Optional[float]
+):
+  """Copy a remote stream into the buffer shared by its subscribers."""
+  error = None
+  try:
+    async for content in _llm_chat_astream_remote(prompts, cache_key, timeout):
+      buffer.append(content)
+  except asyncio.CancelledError:
+    error = RuntimeError("LLM stream was cancelled")
+    raise
+  except Exception as e:
+    error = e
+  finally:
+    if _inflight_streams.get(cache_key, (None,))[0] is buffer:
+      del _inflight_streams[cache_key]
+    buffer.close(error)
+
+
+async def _llm_chat_astream_remote(
+  prompts: Prompts, cache_key: str, timeout: Optional[float]
+) -> AsyncGenerator:
+  retries = LLM_MAX_RETRIES
   tries = 0
   while tries < retries:
+    full_response = []
     try:
-      stream = await _llm_bare_async.chat.completions.create(
-        model=_llm_name,
-        messages=prompts,
-        stream=True,
-      )
-      full_response = []
-      # Process the stream while collecting the full response
-      async for chunk in stream:
-        content = chunk.choices[0].delta.content
-        if content is not None:
+      # The slot is held until the whole stream is consumed
+      async with llm_gateway.slot():
+        stream = await _llm_bare_async.chat.completions.create(
+          model=_llm_name,
+          messages=prompts,
+          stream=True,
+          timeout=timeout or llm_gateway.timeout,
+        )
+        # Process the stream while collecting the full response
+        async for chunk in stream:
+          if not chunk.choices:
+            continue
+          content = chunk.choices[0].delta.content
+          if not content:
+            continue
           full_response.append(content)
-        yield content
-      full_response_str = "".join(full_response).strip()
-      redis_client.set(cache_key, full_response_str, ex=60 * 60 * 24)  # cache for 1 day
+          yield content
+      # Only reached if the stream finished cleanly: errors, cancellation and
+      # consumers closing the generator early never write a partial answer
+      await _cache_set(cache_key, json.dumps(full_response, ensure_ascii=False))
       return
     except Exception as e:
       logging.error(f"Errors occurred: {e}")
+      if full_response:
+        # Part of the answer is already sent, retrying would repeat it
+        raise
       tries += 1
       if tries == retries:
         raise RuntimeError(
           f"Failed to get response from Qwen API after {retries} retries"
         )
+      await asyncio.sleep(_backoff(tries))
+
+
+def get_structured_cache_key(prompt: Prompts, model: type[BaseModel]) -> str:
+  """Structured results are cached per output model, apart from plain answers."""
+  return get_cache_key(prompt).replace(
+    "llm_cache:", f"llm_structured_cache:{model.__name__}:", 1
+  )
+
+
+def _get_structured_runnable(model: type[BaseModel]):
+  """Structured output runnable of a model, built once per model class."""
+  runnable = _structured_runnables.get(model)
+  if runnable is None:
+    runnable = _llm_langchain.with_structured_output(model)
+    _structured_runnables[model] = runnable
+  return runnable
+
+
+def _load_structured(cached_response: Optional[str], model: type[BaseModel]):
+  if not cached_response:
+    return None
+  # Deserialize the cached structured response
+  try:
+    return model(**json.loads(cached_response))
+  except Exception as e:
+    logging.error(f"Failed to deserialize cached structured response: {e}")
+    # Continue with the API call if deserialization fails
+    return None
 
 
 def structure_llm_chat(prompts, model: BaseModel):
-  cache_key = get_cache_key(prompts)
-  cached_response = redis_client.get(cache_key)
+  cache_key = get_structured_cache_key(prompts, model)
+  cached_result = _load_structured(redis_client.get(cache_key), model)
 
-  if cached_response:
+  if cached_result is not None:
     logging.info("LLM cache hit (structured)")
-    # Deserialize the cached structured response
-    try:
-      return model(**json.loads(cached_response))
-    except Exception as e:
-      logging.error(f"Failed to deserialize cached structured response: {e}")
-      # Continue with the API call if deserialization fails
+    return cached_result
   else:
     logging.debug("Calling remote llm")
 
-  llm_strcture = _llm_langchain.with_structured_output(model)
+  llm_strcture = _get_structured_runnable(model)
   retries = 3
   tries = 0
   while tries < retries:
@@ -174,7 +350,7 @@ def structure_llm_chat(prompts, model: BaseModel):
       result = llm_strcture.invoke(prompts)
       # Cache the structured result
       try:
-        serialized_result = json.dumps(result.dict())
+        serialized_result = json.dumps(result.model_dump())
         redis_client.set(
           cache_key, serialized_result, ex=60 * 60 * 24
         )  # cache for 1 day
@@ -183,11 +359,97 @@ def structure_llm_chat(prompts, model: BaseModel):
       return result
     except Exception as e:
       logging.error(f"Errors occurred: {e}")
-      retries -= 1
-      if retries == 0:
+      tries += 1
+      if tries == retries:
+        raise RuntimeError(
+          f"Failed to get response from Qwen API after {retries} retries"
+        )
+
+
+async def structure_llm_chat_async(
+  prompts: Prompts, model: type[BaseModel], timeout: Optional[float] = None
+) -> BaseModel:
+  """Async version of `structure_llm_chat`, with the same cache."""
+  return (await structure_llm_batch_async([prompts], model, timeout))[0]
+
+
+async def structure_llm_batch_async(
+  prompts_list: list[Prompts],
+  model: type[BaseModel],
+  timeout: Optional[float] = None,
+  return_exceptions: bool = False,
+) -> list[BaseModel | BaseException]:
+  """Get structured results of several prompts at once.
+  The cache is read and written in one redis round trip each, and the misses
+  are sent concurrently through the gateway. Every call runs to the end, the
+  successful ones are cached even if others fail.
+  Args:
+    prompts_list: Prompts of every call.
+    model: Output model, shared by all calls.
+    timeout: Timeout of each call in seconds, the gateway default if None.
+    return_exceptions: Put the exception of a failed call in its place in the
+      results, instead of raising the first one.
+  Returns:
+    The results, in the same order as prompts_list.
+  """
+  cache_keys = [get_structured_cache_key(prompts, model) for prompts in prompts_list]
+  cached_responses = [None] * len(cache_keys)
+  if cache_keys:
+    try:
+      cached_responses = await async_redis_client.mget(cache_keys)
+    except RedisError as e:
+      logging.warning(f"LLM cache read failed: {e}")
+  results = [_load_structured(cached, model) for cached in cached_responses]
+  misses = [i for i, result in enumerate(results) if result is None]
+  if len(misses) < len(results):
+    logging.info(f"LLM cache hit (structured): {len(results) - len(misses)}")
+  if not misses:
+    return results
+
+  logging.debug(f"Calling remote llm for {len(misses)} structured results")
+  runnable = _get_structured_runnable(model)
+  miss_results = await asyncio.gather(
+    *[_structure_llm_remote(runnable, prompts_list[i], timeout) for i in misses],
+    return_exceptions=True,
+  )
+  async with async_redis_client.pipeline(transaction=False) as pipe:
+    for i, result in zip(misses, miss_results):
+      results[i] = result
+      if isinstance(result, BaseException):
+        continue
+      pipe.set(
+        cache_keys[i], json.dumps(result.model_dump()), ex=60 * 60 * 24
+      )  # cache for 1 day
+    try:
+      await pipe.execute()
+    except Exception as e:
+      logging.error(f"Failed to cache structured response: {e}")
+  if not return_exceptions:
+    for result in results:
+      if isinstance(result, BaseException):
+        raise result
+  return results
+
+
+async def _structure_llm_remote(
+  runnable, prompts: Prompts, timeout: Optional[float]
+) -> BaseModel:
+  retries = LLM_MAX_RETRIES
+  tries = 0
+  while tries < retries:
+    try:
+      async with llm_gateway.slot():
+        return await asyncio.wait_for(
+          runnable.ainvoke(prompts), timeout or llm_gateway.timeout
+        )
+    except Exception as e:
+      logging.error(f"Errors occurred: {e}")
+      tries += 1
+      if tries == retries:
         raise RuntimeError(
           f"Failed to get response from Qwen API after {retries} retries"
         )
+      await asyncio.sleep(_backoff(tries))
 
 
 def parse_as_json(llm_output: str) -> dict:
@@ -0,0 +1,101 @@
+"""
+Gateway in front of the LLM backend: one tuned connection pool shared by all
+clients, and a limiter on concurrent and per-second completions, so bursts of
+traffic queue up here instead of hitting the provider's rate limits.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+
+
+class LLMGateway:
+  def __init__(
+    self,
+    max_concurrency: int,
+    rate_per_second: Optional[float],
+    timeout: float,
+    connect_timeout: float,
+    max_connections: int,
+  ):
+    """
+    Args:
+      max_concurrency: Max number of calls in flight at once.
+      rate_per_second: Max number of calls started per second, None for no limit.
+      timeout: Default timeout of a call, in seconds.
+      connect_timeout: Timeout of establishing a connection, in seconds.
+      max_connections: Size of the connection pool.
+    """
+    self.timeout = timeout
+    self.http_client = httpx.AsyncClient(
+      limits=httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+      ),
+      timeout=httpx.Timeout(timeout, connect=connect_timeout),
+    )
+    self._semaphore = asyncio.Semaphore(max_concurrency)
+    self.max_concurrency = max_concurrency
+    # Token bucket, refilled at rate_per_second, holding at most one second
+    self.rate_per_second = rate_per_second
+    self._tokens = rate_per_second or 0.0
+    self._refilled_at = time.monotonic()
+    self._rate_lock = asyncio.Lock()
+    # Metrics
+    self.waiting = 0
+    self.in_flight = 0
+    self.completed = 0
+    self.failed = 0
+
+  async def _throttle(self):
+    if not self.rate_per_second:
+      return
+    async with self._rate_lock:
+      now = time.monotonic()
+      self._tokens = min(
+        self.rate_per_second,
+        self._tokens + (now - self._refilled_at) * self.rate_per_second,
+      )
+      self._refilled_at = now
+      if self._tokens < 1:
+        await asyncio.sleep((1 - self._tokens) / self.rate_per_second)
+        self._tokens = 1
+        self._refilled_at = time.monotonic()
+      self._tokens -= 1
+
+  @asynccontextmanager
+  async def slot(self) -> AsyncIterator[None]:
+    """Hold one call slot, waiting for the limiter first.
+    A streamed completion should hold it until the stream is consumed.
+    """
+    self.waiting += 1
+    try:
+      await self._semaphore.acquire()
+    finally:
+      self.waiting -= 1
+    try:
+      await self._throttle()
+      self.in_flight += 1
+      try:
+        yield
+        self.completed += 1
+      except BaseException:
+        self.failed += 1
+        raise
+      finally:
+        self.in_flight -= 1
+    finally:
+      self._semaphore.release()
+
+  def metrics(self) -> dict:
+    return {
+      "waiting": self.waiting,
+      "in_flight": self.in_flight,
+      "max_concurrency": self.max_concurrency,
+      "rate_per_second": self.rate_per_second,
+      "completed": self.completed,
+      "failed": self.failed,
+    }
@@ -0,0 +1,19 @@
+import pytest
+from fastapi import HTTPException
+
+from campus_rag.domain.rag.po import SortedBy
+from campus_rag.impl.user.conversation import _decode_cursor, _encode_cursor
+
+
+def test_cursor_round_trip():
+  cursor = _encode_cursor(SortedBy.created, 1.5, "c")
+  assert _decode_cursor(cursor, SortedBy.created) == (1.5, "c")
+
+
+def test_cursor_rejects_other_sort():
+  cursor = _encode_cursor(SortedBy.updated_reverse, 1.5, "c")
+  with pytest.raises(HTTPException) as e:
+    _decode_cursor(cursor, SortedBy.created)
+  assert e.value.status_code == 400
+  with pytest.raises(HTTPException):
+    _decode_cursor("not a cursor", SortedBy.created)
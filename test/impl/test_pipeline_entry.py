@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import campus_rag.impl.rag.pipeline_entry as pipeline_entry
+from campus_rag.domain.rag.po import ChatEvent, ChatEventKind, Query
+from campus_rag.domain.user.po import User
+from campus_rag.impl.rag.task_backend import InMemoryTaskBackend
+from campus_rag.utils.logging_config import setup_logger
+
+logger = setup_logger()
+
+
+@pytest.fixture
+def backend(monkeypatch) -> InMemoryTaskBackend:
+  backend = InMemoryTaskBackend(max_size=1)
+  monkeypatch.setattr(pipeline_entry, "task_backend", backend)
+
+  async def get_recent_history(user, conversation_id):
+    return []
+
+  monkeypatch.setattr(pipeline_entry, "get_recent_history", get_recent_history)
+  return backend
+
+
+@pytest.mark.asyncio
+async def test_start_pipeline_frees_the_task_when_the_append_fails(
+  backend, monkeypatch
+):
+  async def add_message_to_conversation(*args, **kwargs):
+    raise HTTPException(status_code=404, detail="Conversation not found")
+
+  monkeypatch.setattr(
+    pipeline_entry, "add_message_to_conversation", add_message_to_conversation
+  )
+  query = Query(conversation_id="c", query="hi")
+  # The slot of the failed task is reused, the backend never fills up
+  for _ in range(3):
+    with pytest.raises(HTTPException) as e:
+      await pipeline_entry.start_pipeline(query, User(id=1, username="u", passwd=""))
+    assert e.value.status_code == 404
+  counts = await backend.counts()
+  assert counts["live"] == 0
+  assert counts["error"] == 1
+
+
+class EndlessPipeline:
+  """Streams answer tokens until it is cancelled."""
+
+  async def start(self, query, history):
+    yield ChatEvent(ChatEventKind.ANSWER_START)
+    token = 0
+    while True:
+      yield ChatEvent(ChatEventKind.ANSWER, f"t{token} ")
+      token += 1
+      await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_abandoned_task_is_cancelled_and_partial_answer_saved(
+  backend, monkeypatch
+):
+  messages = []
+
+  async def add_message_to_conversation(user, conversation_id, content, role, **kw):
+    messages.append((role, content))
+
+  monkeypatch.setattr(
+    pipeline_entry, "add_message_to_conversation", add_message_to_conversation
+  )
+  monkeypatch.setattr(pipeline_entry, "ChatPipeline", EndlessPipeline)
+  monkeypatch.setattr(pipeline_entry, "TASK_SUBSCRIBER_CHECK_INTERVAL", 0.01)
+  monkeypatch.setattr(pipeline_entry, "TASK_ABANDON_GRACE", 0.05)
+
+  query = Query(conversation_id="c", query="hi")
+  task_id = await pipeline_entry.start_pipeline(
+    query, User(id=1, username="u", passwd="")
+  )
+  # No client ever streams the task, the watchdog cancels it
+  for _ in range(100):
+    await asyncio.sleep(0.01)
+    if (await backend.get_status(task_id))[0] != "running":
+      break
+  assert await backend.get_status(task_id) == ("cancelled", None)
+  await asyncio.gather(*pipeline_entry._background_tasks)
+  assert messages[0] == ("user", "hi")
+  role, content = messages[1]
+  assert role == "assistant"
+  assert content.startswith("t0 t1")
@@ -1,6 +1,6 @@
 import pytest
 from campus_rag.utils.logging_config import setup_logger
-from campus_rag.impl.rag.llm_tool.route import route_query
+from campus_rag.impl.rag.llm_tool.route import local_route, route_query
 
 logger = setup_logger()
 
@@ -13,3 +13,18 @@ async def test_route_query():
   logger.info(f"Response: {response}")
   assert isinstance(response, list), "Response should be a list."
   assert response, "Response should not be empty."
+
+
+def test_local_route():
+  assert local_route("软件工程导论的教材是什么？") == ["course"]
+  assert local_route("补考怎么申请？") == ["manual"]
+  assert local_route("刘钦老师的研究方向是什么") == ["teacher"]
+  assert local_route("哪些老师有自己的课题组？") == ["teacher"]
+  # Two weak hits of the same source are enough
+  assert local_route("数据结构是必修课程吗") == ["course"]
+  # Ambiguous, weak or unknown queries are left to the LLM
+  assert local_route("课程挂科了怎么办？") is None
+  assert local_route("课程成绩如何认定") is None
+  assert local_route("选课规则") is None
+  assert local_route("有没有事少分高的二层次英语课？") is None
+  assert local_route("你好") is None
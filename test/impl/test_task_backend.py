@@ -0,0 +1,89 @@
+import asyncio
+import fakeredis
+import pytest
+import campus_rag.impl.rag.task_backend as task_backend
+from campus_rag.impl.rag.task_backend import (
+  InMemoryTaskBackend,
+  RedisStreamsTaskBackend,
+)
+from campus_rag.utils.logging_config import setup_logger
+
+logger = setup_logger()
+
+
+@pytest.mark.asyncio
+async def test_in_memory_task_backend():
+  backend = InMemoryTaskBackend()
+  assert await backend.create("t")
+
+  async def _collect(offset: int = 0) -> list:
+    return [chunk async for chunk in backend.subscribe("t", offset)]
+
+  early = asyncio.create_task(_collect())
+  await asyncio.sleep(0)
+  for chunk in ["a", "b", "c"]:
+    await backend.append("t", chunk)
+  await backend.finish("t", "error", "boom")
+  assert await early == ["a", "b", "c"]
+  # Resumes after the chunks a client already got
+  assert await _collect(offset=2) == ["c"]
+  assert await backend.get_status("t") == ("error", "boom")
+  assert await backend.get_status("missing") is None
+
+
+@pytest.fixture
+def redis_backend(monkeypatch) -> RedisStreamsTaskBackend:
+  # Short blocking reads, so expiry checks happen within the test
+  monkeypatch.setattr(task_backend, "TASK_STREAM_BLOCK_MS", 50)
+  redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+  return RedisStreamsTaskBackend(
+    max_size=2, ttl=60, prefix="test:task:", redis=redis, stream_redis=redis
+  )
+
+
+@pytest.mark.asyncio
+async def test_redis_streams_task_backend(redis_backend):
+  backend = redis_backend
+  assert await backend.create("t")
+  assert await backend.get_status("t") == ("running", None)
+
+  async def _collect(offset: int = 0) -> list:
+    return [chunk async for chunk in backend.subscribe("t", offset)]
+
+  early = asyncio.create_task(_collect())
+  await asyncio.sleep(0.01)
+  assert await backend.has_subscribers("t")
+  for chunk in ["a", "b", "c"]:
+    await backend.append("t", chunk)
+  await backend.finish("t", "error", "boom")
+  assert await early == ["a", "b", "c"]
+  assert not await backend.has_subscribers("t")
+  # Resumes after the chunks a client already got
+  assert await _collect(offset=2) == ["c"]
+  assert await _collect(offset=3) == []
+  assert await backend.get_status("t") == ("error", "boom")
+  assert await backend.get_status("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_redis_streams_task_backend_max_size(redis_backend):
+  backend = redis_backend
+  assert await backend.create("a")
+  assert await backend.create("b")
+  assert not await backend.create("c")
+  assert await backend.counts() == {"live": 2, "max_size": 2}
+  await backend.finish("a", "completed")
+  assert await backend.create("c")
+
+
+@pytest.mark.asyncio
+async def test_redis_streams_task_backend_expired_task(redis_backend):
+  backend = redis_backend
+  assert await backend.create("t")
+  await backend.append("t", "a")
+  subscription = backend.subscribe("t")
+  assert await anext(subscription) == "a"
+  # The worker died without finishing the task, its keys expire
+  await backend.redis.delete(backend._key("t"))
+  with pytest.raises(StopAsyncIteration):
+    await asyncio.wait_for(anext(subscription), 1)
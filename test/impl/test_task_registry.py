@@ -0,0 +1,44 @@
+from campus_rag.impl.rag.task_registry import TaskRegistry
+from campus_rag.utils.logging_config import setup_logger
+
+logger = setup_logger()
+
+
+def test_task_registry_lifecycle():
+  registry = TaskRegistry(max_size=4)
+  assert registry.add("a", {"error_message": None})
+  assert registry.add("b", {"error_message": None})
+  registry.finish("a", "completed")
+  registry.finish("b", "error", "boom")
+  assert registry.get("a")["status"] == "completed"
+  assert registry.get("b")["error_message"] == "boom"
+  assert registry.counts() == {
+    "live": 0,
+    "completed": 1,
+    "error": 1,
+    "cancelled": 0,
+    "max_size": 4,
+  }
+
+
+def test_task_registry_ttl_eviction():
+  registry = TaskRegistry(ttl=0)
+  registry.add("a", {})
+  registry.add("b", {})
+  registry.finish("a", "completed")
+  # Finished tasks expire, running ones stay
+  assert registry.get("a") is None
+  assert registry.get("b")["status"] == "running"
+  assert registry.counts()["live"] == 1
+
+
+def test_task_registry_max_size():
+  registry = TaskRegistry(max_size=2)
+  registry.add("a", {})
+  registry.add("b", {})
+  assert not registry.add("c", {})
+  # The oldest finished task makes room for a new one
+  registry.finish("b", "completed")
+  assert registry.add("c", {})
+  assert registry.get("b") is None
+  assert registry.get("a") is not None
@@ -0,0 +1,70 @@
+import re
+
+import pytest
+
+from campus_rag.domain.rag.po import SearchConfig
+from campus_rag.infra.milvus.hybrid_retrieve import HybridRetriever
+
+# Collection in rank order: course dominates the top hits of every query
+_HITS = [{"id": f"course-{i}", "entity": {"source": "course"}} for i in range(10)] + [
+  {"id": f"teacher-{i}", "entity": {"source": "teacher"}} for i in range(3)
+]
+
+
+class RankedRetriever(HybridRetriever):
+  """Serves _HITS in rank order, honoring `source in [...]` filters."""
+
+  def __init__(self):
+    super().__init__(mc=None, collection_name="test")
+    self.configs = []
+
+  async def retrieve(self, question, config, query_embedding=None):
+    self.configs.append(config)
+    hits = _HITS
+    if config.filter_expr:
+      allowed = re.findall(r'"(\w+)"', config.filter_expr)
+      hits = [hit for hit in hits if hit["entity"]["source"] in allowed]
+    return [dict(hit) for hit in hits[: config.limit]]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_by_sources_dominant_source():
+  retriever = RankedRetriever()
+  results = await retriever.retrieve_by_sources(
+    "q", ["teacher", "course", "global"], SearchConfig(limit=2)
+  )
+  # The routed teacher bucket is full, although course holds the top 10 hits
+  assert [hit["id"] for hit in results["teacher"]] == ["teacher-0", "teacher-1"]
+  assert [hit["id"] for hit in results["course"]] == ["course-0", "course-1"]
+  assert [hit["id"] for hit in results["global"]] == ["course-0", "course-1"]
+  # The union came back all course, teacher is searched again on its own
+  assert [config.filter_expr for config in retriever.configs] == [
+    'source in ["teacher", "course"]',
+    None,
+    'source == "teacher"',
+  ]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_by_sources_single_search():
+  retriever = RankedRetriever()
+  results = await retriever.retrieve_by_sources(
+    "q", ["teacher"], SearchConfig(limit=5, filter_expr="year > 0")
+  )
+  # The union ran out of teacher hits, searching teacher again would not help
+  assert len(results["teacher"]) == 3
+  assert [config.filter_expr for config in retriever.configs] == [
+    'source in ["teacher"] AND (year > 0)',
+  ]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_by_sources_global_only():
+  retriever = RankedRetriever()
+  results = await retriever.retrieve_by_sources("q", ["global"], SearchConfig(limit=3))
+  assert [hit["id"] for hit in results["global"]] == [
+    "course-0",
+    "course-1",
+    "course-2",
+  ]
+  assert len(retriever.configs) == 1
@@ -0,0 +1,60 @@
+from campus_rag.infra.reranker import CachedReranker, ModelReranker
+from campus_rag.utils.logging_config import setup_logger
+
+logger = setup_logger()
+
+
+class CountingReranker(ModelReranker):
+  """Scores by chunk length and records how many pairs it was asked to score."""
+
+  def __init__(self):
+    self.scored = 0
+
+  def score(self, query, results):
+    self.scored += len(results)
+    return [float(len(res["entity"]["chunk"])) for res in results]
+
+  def rerank(self, query, results):
+    pass
+
+  def get_name(self):
+    return "counting"
+
+
+def _result(chunk_id: str, chunk: str) -> dict:
+  return {
+    "id": chunk_id,
+    "entity": {"source": "manual", "context": "", "chunk": chunk},
+  }
+
+
+def test_cached_reranker_scores_only_misses():
+  inner = CountingReranker()
+  reranker = CachedReranker(inner)
+  results = reranker.rerank("补考", [_result("a", "x"), _result("b", "xxx")])
+  assert [res["id"] for res in results] == ["b", "a"]
+  assert inner.scored == 2
+
+  # Normalized query hits the cache, only the new chunk is scored
+  reranker.rerank(" 补考 ", [_result("a", "x"), _result("c", "xx")])
+  assert inner.scored == 3
+
+
+def test_cached_reranker_invalidation():
+  inner = CountingReranker()
+  reranker = CachedReranker(inner)
+  reranker.rerank("补考", [_result("a", "x")])
+  # Modified content has a new hash, so it is a miss
+  reranker.rerank("补考", [_result("a", "xx")])
+  assert inner.scored == 2
+  reranker.invalidate("a")
+  reranker.rerank("补考", [_result("a", "xx")])
+  assert inner.scored == 3
+
+
+def test_cached_reranker_lru_eviction():
+  inner = CountingReranker()
+  reranker = CachedReranker(inner, max_size=2)
+  reranker.rerank("q", [_result("a", "x"), _result("b", "x"), _result("c", "x")])
+  reranker.rerank("q", [_result("a", "x")])
+  assert inner.scored == 4
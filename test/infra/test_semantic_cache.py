@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import campus_rag.infra.semantic_cache as semantic_cache
+from campus_rag.infra.semantic_cache import SemanticCache
+
+
+def _unit(*values: float) -> np.ndarray:
+  vector = np.array(values, dtype=np.float32)
+  return vector / np.linalg.norm(vector)
+
+
+def test_semantic_cache_lookup():
+  cache = SemanticCache("test", threshold=0.95, max_size=4)
+  assert cache.lookup(_unit(1, 0, 0)) is None
+  cache.store(_unit(1, 0, 0), "a")
+  cache.store(_unit(0, 1, 0), "b")
+  assert cache.lookup(_unit(1, 0, 0)) == "a"
+  # Nearest entry wins, as long as it is above the threshold
+  assert cache.lookup(_unit(0.1, 1, 0)) == "b"
+  assert cache.lookup(_unit(1, 1, 0)) is None
+
+
+def test_semantic_cache_ttl(monkeypatch):
+  now = 1000.0
+  monkeypatch.setattr(semantic_cache.time, "time", lambda: now)
+  cache = SemanticCache("test", ttl=10)
+  cache.store(_unit(1, 0), "a")
+  now += 5
+  assert cache.lookup(_unit(1, 0)) == "a"
+  now += 10
+  assert cache.lookup(_unit(1, 0)) is None
+
+
+def test_semantic_cache_ring_eviction():
+  cache = SemanticCache("test", max_size=2)
+  cache.store(_unit(1, 0, 0), "a")
+  cache.store(_unit(0, 1, 0), "b")
+  # Overwrites the oldest entry
+  cache.store(_unit(0, 0, 1), "c")
+  assert cache.lookup(_unit(1, 0, 0)) is None
+  assert cache.lookup(_unit(0, 1, 0)) == "b"
+  assert cache.lookup(_unit(0, 0, 1)) == "c"
+
+
+def test_semantic_cache_clear():
+  cache = SemanticCache("test")
+  cache.store(_unit(1, 0), "a")
+  cache.clear()
+  assert cache.lookup(_unit(1, 0)) is None
+  cache.store(_unit(1, 0), "b")
+  assert cache.lookup(_unit(1, 0)) == "b"
+
+
+class FakeRedis:
+  def __init__(self):
+    self.values = {}
+
+  async def get(self, key):
+    return self.values.get(key)
+
+  async def incr(self, key):
+    self.values[key] = str(int(self.values.get(key, 0)) + 1)
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_invalidation_across_workers(monkeypatch):
+  monkeypatch.setattr(semantic_cache, "async_redis_client", FakeRedis())
+  assert await semantic_cache.sync_semantic_caches()
+  semantic_cache.answer_cache.store(_unit(1, 0), "answer")
+  assert await semantic_cache.sync_semantic_caches()
+  assert semantic_cache.answer_cache.lookup(_unit(1, 0)) == "answer"
+
+  # Another worker bumps the version, this one drops its entries on sync
+  monkeypatch.setattr(semantic_cache, "_version", "other")
+  assert await semantic_cache.sync_semantic_caches()
+  assert semantic_cache.answer_cache.lookup(_unit(1, 0)) is None
+
+  semantic_cache.answer_cache.store(_unit(1, 0), "answer")
+  await semantic_cache.invalidate_semantic_caches()
+  assert semantic_cache.answer_cache.lookup(_unit(1, 0)) is None
+  assert await semantic_cache.async_redis_client.get("semantic_cache:version") == "1"
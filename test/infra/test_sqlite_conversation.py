@@ -0,0 +1,123 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+
+import campus_rag.domain.rag.po  # noqa 确保表结构被注册
+from campus_rag.domain.rag.po import ChatMessage
+import campus_rag.domain.user.po  # noqa
+from campus_rag.infra.sqlite import conversation as db
+from campus_rag.utils.logging_config import setup_logger
+
+logger = setup_logger()
+
+TEST_USER_ID = 1
+
+
+@pytest_asyncio.fixture
+async def temp_db(tmp_path, monkeypatch):
+  """Points the conversation db layer to an empty database in tmp_path."""
+  db_file = (tmp_path / "test_conversation.db").resolve()
+  SQLModel.metadata.create_all(create_engine(f"sqlite:///{db_file}"))
+  engine = create_async_engine(f"sqlite+aiosqlite:///{db_file}")
+  monkeypatch.setattr(
+    "campus_rag.infra.sqlite.conversation.async_session",
+    async_sessionmaker(engine, expire_on_commit=False),
+  )
+  yield
+  await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_append_message(temp_db):
+  conversation = await db.insert_conversation(TEST_USER_ID)
+  conversation_id = conversation.conversation_id
+
+  message, needs_title = await db.append_message(
+    TEST_USER_ID, conversation_id, "补考怎么申请？", "user", default_title="补考"
+  )
+  assert message.content == "补考怎么申请？"
+  assert needs_title
+  _, needs_title = await db.append_message(
+    TEST_USER_ID, conversation_id, "回答", "assistant", metainfo="..."
+  )
+  assert not needs_title
+  _, needs_title = await db.append_message(
+    TEST_USER_ID, conversation_id, "还有呢？", "user"
+  )
+  assert not needs_title
+
+  messages = await db.find_messages_by_conversation(conversation_id)
+  assert [m.role for m in messages] == ["user", "assistant", "user"]
+  updated = await db.find_conversation_by_id(TEST_USER_ID, conversation_id)
+  assert updated.update_time >= conversation.update_time
+  assert updated.title == "补考"
+
+
+@pytest.mark.asyncio
+async def test_append_message_ownership(temp_db):
+  conversation = await db.insert_conversation(TEST_USER_ID)
+  assert (
+    await db.append_message(TEST_USER_ID + 1, conversation.conversation_id, "x", "user")
+    is None
+  )
+  assert await db.find_messages_by_conversation(conversation.conversation_id) == []
+
+
+@pytest.mark.asyncio
+async def test_find_recent_messages(temp_db):
+  conversation = await db.insert_conversation(TEST_USER_ID)
+  for i in range(5):
+    await db.append_message(TEST_USER_ID, conversation.conversation_id, str(i), "user")
+  recent = await db.find_recent_messages(conversation.conversation_id, limit=3)
+  assert [m.content for m in recent] == ["2", "3", "4"]
+  found = await db.find_conversation_by_id(
+    TEST_USER_ID, conversation.conversation_id, with_messages=False
+  )
+  assert "messages" not in found.__dict__
+
+
+@pytest.mark.asyncio
+async def test_recent_messages_ties(temp_db):
+  conversation = await db.insert_conversation(TEST_USER_ID)
+  conversation_id = conversation.conversation_id
+  # Same timestamp, the history window and the paged history agree on order
+  async with db.async_session() as session:
+    for i in range(4):
+      session.add(
+        ChatMessage(
+          conversation_id=conversation_id,
+          role="user",
+          content=str(i),
+          create_time=1.0,
+        )
+      )
+    await session.commit()
+  paged = await db.find_messages_by_conversation(conversation_id)
+  recent = await db.find_recent_messages(conversation_id, limit=3)
+  assert [m.message_id for m in recent] == [m.message_id for m in paged[1:]]
+
+
+@pytest.mark.asyncio
+async def test_keyset_pagination(temp_db):
+  for _ in range(5):
+    await db.insert_conversation(TEST_USER_ID)
+  everything = await db.find_conversations_by_user(TEST_USER_ID, limit=10)
+  pages, after = [], None
+  while True:
+    page = await db.find_conversations_by_user(TEST_USER_ID, limit=2, after=after)
+    if not page:
+      break
+    pages.extend(page)
+    after = (page[-1].update_time, page[-1].conversation_id)
+  assert [c.conversation_id for c in pages] == [c.conversation_id for c in everything]
+
+  conversation_id = everything[0].conversation_id
+  for i in range(4):
+    await db.append_message(TEST_USER_ID, conversation_id, str(i), "user")
+  first = await db.find_messages_by_conversation(conversation_id, limit=3)
+  rest = await db.find_messages_by_conversation(
+    conversation_id, after_id=first[-1].message_id
+  )
+  assert [m.content for m in first + rest] == ["0", "1", "2", "3"]
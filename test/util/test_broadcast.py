@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from campus_rag.utils.broadcast import ReplayBuffer
+
+
+async def _collect(buffer: ReplayBuffer, offset: int = 0) -> list:
+  return [item async for item in buffer.subscribe(offset)]
+
+
+@pytest.mark.asyncio
+async def test_replay_buffer_fan_out():
+  buffer = ReplayBuffer()
+  early = asyncio.create_task(_collect(buffer))
+  await asyncio.sleep(0)
+  buffer.append("a")
+  buffer.append("b")
+  # Joins late, still gets every item
+  late = asyncio.create_task(_collect(buffer))
+  await asyncio.sleep(0)
+  buffer.append("c")
+  buffer.close()
+  assert await early == ["a", "b", "c"]
+  assert await late == ["a", "b", "c"]
+  assert await _collect(buffer, offset=2) == ["c"]
+  assert buffer.subscribers == 0
+
+
+@pytest.mark.asyncio
+async def test_replay_buffer_error():
+  buffer = ReplayBuffer()
+  buffer.append("a")
+  buffer.close(ValueError("boom"))
+  items = []
+  with pytest.raises(ValueError):
+    async for item in buffer.subscribe():
+      items.append(item)
+  assert items == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_replay_buffer_backpressure():
+  buffer = ReplayBuffer()
+  subscription = buffer.subscribe()
+  for item in range(4):
+    buffer.append(item)
+  assert await anext(subscription) == 0
+  # The first item is only read once the next one is asked for
+  assert buffer.lag() == 4
+  waiting = asyncio.create_task(buffer.wait_for_readers(max_lag=2, timeout=1))
+  await anext(subscription)
+  await asyncio.sleep(0)
+  assert not waiting.done()
+  await anext(subscription)
+  assert await waiting
+  await subscription.aclose()
+  assert buffer.lag() == 0
+
+
+@pytest.mark.asyncio
+async def test_replay_buffer_stuck_subscriber():
+  buffer = ReplayBuffer()
+  stuck = buffer.subscribe()
+  buffer.append(0)
+  assert await anext(stuck) == 0
+  healthy = asyncio.create_task(_collect(buffer))
+  start = asyncio.get_running_loop().time()
+  for item in range(1, 300):
+    buffer.append(item)
+    await buffer.wait_for_readers(max_lag=8, timeout=0.05)
+    await asyncio.sleep(0)
+  # Only the first wait for the stuck subscriber times out
+  assert asyncio.get_running_loop().time() - start < 0.5
+  assert buffer.lag() == 0
+
+  # Once caught up, it is waited for again
+  for item in range(1, 300):
+    assert await anext(stuck) == item
+  waiting = asyncio.create_task(anext(stuck))
+  await asyncio.sleep(0)
+  buffer.append(300)
+  assert await waiting == 300
+  await asyncio.sleep(0)
+  assert buffer.lag() == 1
+  buffer.close()
+  assert await healthy == list(range(301))
+  await stuck.aclose()
+  assert buffer.subscribers == 0
@@ -1,4 +1,11 @@
-from campus_rag.utils.keyword_explain import get_keyword_explain
+import json
+import os
+import time
+from campus_rag.utils.keyword_explain import (
+  _KeywordMatcher,
+  get_glossary,
+  get_keyword_explain,
+)
 from campus_rag.utils.logging_config import setup_logger
 
 logger = setup_logger()
@@ -12,3 +19,32 @@ def test_keyword_explain():
 def test_schedule_keyword_explain():
   result = get_keyword_explain("data/keywords_for_schedule.json")
   logger.info(f"Course keyword explain result: {result}")
+
+
+def test_keyword_explain_only_matched():
+  result = get_keyword_explain("data/keywords.json", "南哪软工三的nlp怎么样")
+  logger.info(f"Matched keyword explain result: {result}")
+  assert result.splitlines() == [
+    "南哪: 南京大学",
+    "NLP: 自然语言处理",
+    "软工三: 课程软件工程与计算Ⅲ",
+  ]
+  assert get_keyword_explain("data/keywords.json", "你好") == (
+    "No keyword explanations found."
+  )
+
+
+def test_glossary_reload(tmp_path):
+  path = tmp_path / "keywords.json"
+  path.write_text(json.dumps([{"keyword": "早八", "explanation": "8点的课"}]))
+  glossary = get_glossary(str(path))
+  assert glossary.explain("早八") == "早八: 8点的课"
+  path.write_text(json.dumps([{"keyword": "早十", "explanation": "10点的课"}]))
+  os.utime(path, (time.time() + 10, time.time() + 10))
+  assert glossary.explain("早八") == "No keyword explanations found."
+  assert glossary.explain("早十") == "早十: 10点的课"
+
+
+def test_keyword_matcher_overlap():
+  matcher = _KeywordMatcher(["he", "she", "his", "hers"])
+  assert matcher.find("ushers") == {0, 1, 3}
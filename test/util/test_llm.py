@@ -0,0 +1,309 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from pydantic import BaseModel
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+import campus_rag.utils.llm as llm
+
+
+class DownRedis:
+  """Redis client whose every command fails, like an exhausted pool."""
+
+  async def get(self, key):
+    raise RedisConnectionError("No connection available.")
+
+  async def set(self, key, value, ex=None):
+    raise RedisConnectionError("No connection available.")
+
+
+class FakeCompletions:
+  def __init__(self, answer: str):
+    self.answer = answer
+    self.calls = 0
+
+  async def create(self, model, messages, timeout, stream=False):
+    self.calls += 1
+    if stream:
+      return self._stream()
+    message = SimpleNamespace(content=self.answer)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+  async def _stream(self):
+    for content in self.answer.split(" "):
+      delta = SimpleNamespace(content=content)
+      yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+@pytest.fixture
+def down_redis(monkeypatch) -> FakeCompletions:
+  completions = FakeCompletions("cache is down")
+  monkeypatch.setattr(llm, "async_redis_client", DownRedis())
+  monkeypatch.setattr(
+    llm,
+    "_llm_bare_async",
+    SimpleNamespace(chat=SimpleNamespace(completions=completions)),
+  )
+  return completions
+
+
+@pytest.mark.asyncio
+async def test_llm_chat_async_without_cache(down_redis):
+  prompts = [{"role": "user", "content": "redis down, chat"}]
+  assert await llm.llm_chat_async(prompts) == "cache is down"
+  # The failed cache write is not retried as a failed LLM call
+  assert down_redis.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_llm_chat_astream_without_cache(down_redis):
+  prompts = [{"role": "user", "content": "redis down, stream"}]
+  chunks = [chunk async for chunk in llm.llm_chat_astream(prompts)]
+  assert chunks == ["cache", "is", "down"]
+  assert down_redis.calls == 1
+
+
+class Answer(BaseModel):
+  text: str
+
+
+class DictRedis:
+  """Redis client keeping values in a dict, with the commands the helpers use."""
+
+  def __init__(self):
+    self.values = {}
+
+  async def get(self, key):
+    return self.values.get(key)
+
+  async def set(self, key, value, ex=None):
+    self.values[key] = value
+
+  async def mget(self, keys):
+    return [self.values.get(key) for key in keys]
+
+  def pipeline(self, transaction=True):
+    return DictPipeline(self)
+
+
+class DictPipeline:
+  def __init__(self, redis: DictRedis):
+    self.redis = redis
+    self.commands = []
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info):
+    pass
+
+  def set(self, key, value, ex=None):
+    self.commands.append((key, value))
+
+  async def execute(self):
+    self.redis.values.update(self.commands)
+
+
+class EchoRunnable:
+  """Answers with the prompt content, fails on prompts starting with "fail"."""
+
+  def __init__(self):
+    self.calls = []
+
+  async def ainvoke(self, prompts):
+    content = prompts[0]["content"]
+    self.calls.append(content)
+    if content.startswith("fail"):
+      raise ValueError(content)
+    return Answer(text=content)
+
+
+@pytest.fixture
+def echo_llm(monkeypatch) -> EchoRunnable:
+  runnable = EchoRunnable()
+  monkeypatch.setattr(llm, "async_redis_client", DictRedis())
+  monkeypatch.setattr(llm, "_get_structured_runnable", lambda model: runnable)
+  monkeypatch.setattr(llm, "_backoff", lambda tries: 0)
+  return runnable
+
+
+def _prompts(*contents: str) -> list:
+  return [[{"role": "user", "content": content}] for content in contents]
+
+
+@pytest.mark.asyncio
+async def test_structure_llm_batch_cache(echo_llm):
+  results = await llm.structure_llm_batch_async(_prompts("a", "b"), Answer)
+  assert [result.text for result in results] == ["a", "b"]
+  assert echo_llm.calls == ["a", "b"]
+
+  # Hits and misses mixed, results keep the order of the prompts
+  results = await llm.structure_llm_batch_async(_prompts("c", "a", "b"), Answer)
+  assert [result.text for result in results] == ["c", "a", "b"]
+  assert echo_llm.calls == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_structure_llm_batch_failures(echo_llm):
+  prompts = _prompts("x", "fail y", "z")
+  results = await llm.structure_llm_batch_async(prompts, Answer, return_exceptions=True)
+  assert results[0].text == "x"
+  assert isinstance(results[1], RuntimeError)
+  assert results[2].text == "z"
+
+  # The successful calls were cached, only the failed one is sent again
+  calls = len(echo_llm.calls)
+  with pytest.raises(RuntimeError):
+    await llm.structure_llm_batch_async(prompts, Answer)
+  assert echo_llm.calls[calls:] == ["fail y"] * llm.LLM_MAX_RETRIES
+
+
+@pytest.mark.asyncio
+async def test_structured_call_attempts(monkeypatch):
+  requests = []
+
+  def handler(request: httpx.Request) -> httpx.Response:
+    requests.append(request)
+    return httpx.Response(500, json={"error": {"message": "upstream down"}})
+
+  monkeypatch.setattr(llm, "async_redis_client", DictRedis())
+  monkeypatch.setattr(llm, "_backoff", lambda tries: 0)
+  monkeypatch.setattr(
+    llm.llm_gateway.http_client, "_transport", httpx.MockTransport(handler)
+  )
+  with pytest.raises(RuntimeError):
+    await llm.structure_llm_chat_async(_prompts("attempts")[0], Answer)
+  # Only our own retries reach the upstream, the SDK does not retry under them
+  assert len(requests) == llm.LLM_MAX_RETRIES
+
+
+class GatedCompletions:
+  """Answers once `release` is set, every call fails if `fail` is set."""
+
+  def __init__(self, answer: str):
+    self.answer = answer
+    self.calls = 0
+    self.release = asyncio.Event()
+    self.fail = False
+
+  async def create(self, model, messages, timeout, stream=False):
+    self.calls += 1
+    if stream:
+      return self._stream()
+    await self.release.wait()
+    if self.fail:
+      raise ValueError("upstream down")
+    message = SimpleNamespace(content=self.answer)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+  async def _stream(self):
+    for content in self.answer.split(" "):
+      await self.release.wait()
+      if self.fail:
+        raise ValueError("upstream down")
+      delta = SimpleNamespace(content=content)
+      yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+@pytest.fixture
+def gated_llm(monkeypatch) -> GatedCompletions:
+  completions = GatedCompletions("shared answer")
+  monkeypatch.setattr(llm, "async_redis_client", DictRedis())
+  monkeypatch.setattr(llm, "_backoff", lambda tries: 0)
+  monkeypatch.setattr(
+    llm,
+    "_llm_bare_async",
+    SimpleNamespace(chat=SimpleNamespace(completions=completions)),
+  )
+  return completions
+
+
+async def _collect(prompts: list) -> list[str]:
+  return [chunk async for chunk in llm.llm_chat_astream(prompts, replay_interval=0)]
+
+
+@pytest.mark.asyncio
+async def test_llm_chat_async_single_flight(gated_llm):
+  prompts = [{"role": "user", "content": "single flight, chat"}]
+  calls = [asyncio.create_task(llm.llm_chat_async(prompts)) for _ in range(3)]
+  await asyncio.sleep(0.01)
+  assert len(llm._inflight_calls) == 1
+  gated_llm.release.set()
+  assert await asyncio.gather(*calls) == ["shared answer"] * 3
+  assert gated_llm.calls == 1
+  assert not llm._inflight_calls
+
+
+@pytest.mark.asyncio
+async def test_llm_chat_async_single_flight_error(gated_llm):
+  prompts = [{"role": "user", "content": "single flight, chat error"}]
+  gated_llm.fail = True
+  gated_llm.release.set()
+  calls = [llm.llm_chat_async(prompts) for _ in range(3)]
+  results = await asyncio.gather(*calls, return_exceptions=True)
+  assert all(isinstance(result, RuntimeError) for result in results)
+  assert gated_llm.calls == llm.LLM_MAX_RETRIES
+  # The failed call is not joined again, the next caller starts a new one
+  assert not llm._inflight_calls
+  gated_llm.fail = False
+  assert await llm.llm_chat_async(prompts) == "shared answer"
+  assert gated_llm.calls == llm.LLM_MAX_RETRIES + 1
+
+
+@pytest.mark.asyncio
+async def test_llm_chat_async_single_flight_cancelled_caller(gated_llm):
+  prompts = [{"role": "user", "content": "single flight, chat cancel"}]
+  first = asyncio.create_task(llm.llm_chat_async(prompts))
+  second = asyncio.create_task(llm.llm_chat_async(prompts))
+  await asyncio.sleep(0.01)
+  first.cancel()
+  gated_llm.release.set()
+  assert await second == "shared answer"
+  with pytest.raises(asyncio.CancelledError):
+    await first
+  assert gated_llm.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_llm_chat_astream_single_flight(gated_llm):
+  prompts = [{"role": "user", "content": "single flight, stream"}]
+  streams = [asyncio.create_task(_collect(prompts)) for _ in range(3)]
+  await asyncio.sleep(0.01)
+  assert len(llm._inflight_streams) == 1
+  gated_llm.release.set()
+  assert await asyncio.gather(*streams) == [["shared", "answer"]] * 3
+  assert gated_llm.calls == 1
+  assert not llm._inflight_streams
+
+
+@pytest.mark.asyncio
+async def test_llm_chat_astream_single_flight_error(gated_llm):
+  prompts = [{"role": "user", "content": "single flight, stream error"}]
+  gated_llm.fail = True
+  gated_llm.release.set()
+  streams = [_collect(prompts) for _ in range(3)]
+  results = await asyncio.gather(*streams, return_exceptions=True)
+  assert all(isinstance(result, RuntimeError) for result in results)
+  assert gated_llm.calls == llm.LLM_MAX_RETRIES
+  assert not llm._inflight_streams
+  gated_llm.fail = False
+  assert await _collect(prompts) == ["shared", "answer"]
+  assert gated_llm.calls == llm.LLM_MAX_RETRIES + 1
+
+
+@pytest.mark.asyncio
+async def test_llm_chat_astream_single_flight_cancelled_caller(gated_llm):
+  prompts = [{"role": "user", "content": "single flight, stream cancel"}]
+  first = asyncio.create_task(_collect(prompts))
+  second = asyncio.create_task(_collect(prompts))
+  await asyncio.sleep(0.01)
+  first.cancel()
+  gated_llm.release.set()
+  # The stream goes on for the subscriber left
+  assert await second == ["shared", "answer"]
+  with pytest.raises(asyncio.CancelledError):
+    await first
+  assert gated_llm.calls == 1
+  assert not llm._inflight_streams